@@ -1,21 +1,143 @@
 from fastapi import FastAPI, Request, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 import httpx
-from typing import Optional
+from typing import Optional, Dict
+import asyncio
+import hashlib
+import json
 import logging
+import os
+import time
+import uuid
 from datetime import datetime
+from urllib.parse import urlencode
 import jwt
 from pydantic import BaseModel
+from common.service_client import DEADLINE_HEADER, REQUEST_ID_HEADER
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Service Registry - In production, use service discovery like Consul/Eureka
+SERVICE_REGISTRY = {
+    "user": "http://user-service:8001",
+    "product": "http://product-service:8002",
+    "order": "http://order-service:8003",
+    "payment": "http://payment-service:8004",
+    "notification": "http://notification-service:8005",
+    "inventory": "http://inventory-service:8006",
+}
+
+# Upstream connection pool configuration
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "30.0"))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", "20")
+)
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30.0"))
+# HTTP/2 to the upstream services (h2 ships with the httpx[http2] dependency)
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "false").lower() == "true"
+
+# Aggregate health check configuration
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "2.0"))
+HEALTH_CACHE_TTL = float(os.getenv("HEALTH_CACHE_TTL", "5.0"))
+
+# Response cache for public product reads
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", "30.0"))
+PRODUCT_CACHE_MAX_ENTRIES = int(os.getenv("PRODUCT_CACHE_MAX_ENTRIES", "1024"))
+PRODUCT_CACHE_MAX_ENTRY_BYTES = int(
+    os.getenv("PRODUCT_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024))
+)
+
+# Largest upstream body buffered to be shared between coalesced GETs
+SINGLE_FLIGHT_MAX_BYTES = int(os.getenv("SINGLE_FLIGHT_MAX_BYTES", str(1024 * 1024)))
+# Request headers that change the upstream response to a GET
+NEGOTIATION_HEADERS = (
+    "accept",
+    "accept-encoding",
+    "if-none-match",
+    "if-modified-since",
+)
+
+# Circuit breaker and retry configuration
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RECOVERY_TIMEOUT = float(os.getenv("CIRCUIT_RECOVERY_TIMEOUT", "30.0"))
+# GETs and requests carrying an Idempotency-Key only
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+UPSTREAM_RETRY_BACKOFF = float(os.getenv("UPSTREAM_RETRY_BACKOFF", "0.05"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN = float(os.getenv("RETRY_BUDGET_MIN", "10"))
+
+# Headers that only apply to a single connection and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailers",
+    "transfer-encoding",
+    "upgrade",
+}
+
+# Upstream response headers passed through to the client in streaming mode
+FORWARDED_RESPONSE_HEADERS = {
+    "cache-control",
+    "content-disposition",
+    "content-encoding",
+    "content-language",
+    "content-length",
+    "content-type",
+    "etag",
+    "expires",
+    "idempotent-replayed",
+    "last-modified",
+    "location",
+    "preference-applied",
+    "retry-after",
+    "vary",
+}
+
+# One long-lived client per upstream service, created in the lifespan hook
+service_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def create_service_client(service_url: str) -> httpx.AsyncClient:
+    """Create a pooled HTTP client for an upstream service"""
+    return httpx.AsyncClient(
+        base_url=service_url,
+        timeout=UPSTREAM_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+        http2=UPSTREAM_HTTP2,
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    for service_name, service_url in SERVICE_REGISTRY.items():
+        service_clients[service_name] = create_service_client(service_url)
+    try:
+        yield
+    finally:
+        await asyncio.gather(*(client.aclose() for client in service_clients.values()))
+        service_clients.clear()
+        await rate_limiter.backend.close()
+
+
 app = FastAPI(
     title="ShopMicro API Gateway",
     description="Central API Gateway for E-Commerce Microservices",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS Middleware
@@ -27,47 +149,190 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Service Registry - In production, use service discovery like Consul/Eureka
-SERVICE_REGISTRY = {
-    "user": "http://user-service:8001",
-    "product": "http://product-service:8002",
-    "order": "http://order-service:8003",
-    "payment": "http://payment-service:8004",
-    "notification": "http://notification-service:8005",
-    "inventory": "http://inventory-service:8006",
+# Secret key for JWT validation
+SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
+ALGORITHM = "HS256"
+
+# Optional JSON file of kid -> secret, reloaded on change for key rotation
+JWT_KEYS_FILE = os.getenv("JWT_KEYS_FILE", "")
+JWT_KEYS_RELOAD_INTERVAL = float(os.getenv("JWT_KEYS_RELOAD_INTERVAL", "10.0"))
+JWT_CACHE_MAX_ENTRIES = int(os.getenv("JWT_CACHE_MAX_ENTRIES", "10000"))
+# Cache lifetime for tokens without an exp claim
+JWT_CACHE_MAX_TTL = float(os.getenv("JWT_CACHE_MAX_TTL", "300.0"))
+
+
+# Rate limiting configuration
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory, redis
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "60"))  # seconds
+RATE_LIMIT_PER_IP = int(os.getenv("RATE_LIMIT_PER_IP", "100"))
+RATE_LIMIT_PER_USER = int(os.getenv("RATE_LIMIT_PER_USER", "300"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+# Per-route limits (requests per window), matched by longest path prefix.
+# Each route gets its own bucket per client so it cannot starve the others.
+ROUTE_RATE_LIMITS = {
+    "/api/users/register": 10,
+    "/api/users/login": 20,
+    "/api/payments": 30,
 }
 
-# Secret key for JWT validation (should be in environment variables)
-SECRET_KEY = "your-secret-key-change-in-production"
-ALGORITHM = "HS256"
 
+class RateLimitBackend:
+    """
+    Storage for sliding-window counters
+
+    Each key holds a fixed amount of state: the request count of the current
+    and the previous window. The request rate is estimated by weighting the
+    previous window by how much of it still overlaps the sliding window.
+    """
+
+    async def hit(self, key: str, limit: int, window: int) -> tuple[bool, int, int]:
+        """Count a request against key, returns (allowed, remaining, retry_after)"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """Per-process backend, limits are not shared between gateway replicas"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        # key -> [window_id, current_count, previous_count, window]
+        # ordered by last access so idle keys can be evicted from the front
+        self.counters: OrderedDict[str, list] = OrderedDict()
+
+    def _evict_idle_keys(self, now: float):
+        while self.counters:
+            key, (window_id, _, _, window) = next(iter(self.counters.items()))
+            idle = window_id < int(now // window) - 1
+            if not idle and len(self.counters) <= self.max_keys:
+                break
+            del self.counters[key]
+
+    async def hit(self, key: str, limit: int, window: int) -> tuple[bool, int, int]:
+        now = time.time()
+        window_id = int(now // window)
+
+        state = self.counters.get(key)
+        if state is None:
+            state = [window_id, 0, 0, window]
+            self.counters[key] = state
+        elif state[0] != window_id:
+            # Roll the window forward, anything older than one window is dropped
+            state[2] = state[1] if state[0] == window_id - 1 else 0
+            state[1] = 0
+            state[0] = window_id
+        self.counters.move_to_end(key)
+        self._evict_idle_keys(now)
+
+        elapsed = (now % window) / window
+        estimated = state[2] * (1 - elapsed) + state[1]
+        if estimated >= limit:
+            return False, 0, max(1, int(window - now % window))
+
+        state[1] += 1
+        return True, max(0, int(limit - estimated - 1)), 0
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """Backend shared by all gateway replicas through a Redis-protocol server"""
+
+    # Check and increment atomically so concurrent replicas cannot overshoot
+    HIT_SCRIPT = """
+    local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+    local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+    local estimated = previous * tonumber(ARGV[2]) + current
+    if estimated >= tonumber(ARGV[1]) then
+        return {0, tostring(estimated)}
+    end
+    redis.call('INCR', KEYS[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return {1, tostring(estimated)}
+    """
+
+    def __init__(self, redis_url: str = REDIS_URL, prefix: str = "ratelimit"):
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(redis_url)
+        self.prefix = prefix
+        self.script = self.redis.register_script(self.HIT_SCRIPT)
+
+    async def hit(self, key: str, limit: int, window: int) -> tuple[bool, int, int]:
+        now = time.time()
+        window_id = int(now // window)
+        elapsed = (now % window) / window
+
+        allowed, estimated = await self.script(
+            keys=[
+                f"{self.prefix}:{key}:{window_id}",
+                f"{self.prefix}:{key}:{window_id - 1}",
+            ],
+            args=[limit, 1 - elapsed, window * 2],
+        )
+        if not allowed:
+            return False, 0, max(1, int(window - now % window))
+        return True, max(0, int(limit - float(estimated) - 1)), 0
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+def create_rate_limit_backend() -> RateLimitBackend:
+    if RATE_LIMIT_BACKEND == "redis":
+        return RedisRateLimitBackend(REDIS_URL)
+    return InMemoryRateLimitBackend()
 
-class RateLimiter:
-    """Simple in-memory rate limiter - use Redis in production"""
 
-    def __init__(self):
-        self.requests = {}
+class RateLimiter:
+    """Sliding-window-counter rate limiter with per-route and per-user limits"""
+
+    def __init__(self, backend: RateLimitBackend, window: int = RATE_LIMIT_WINDOW):
+        self.backend = backend
+        self.window = window
+
+    def route_limit(self, path: str) -> tuple[str, Optional[int]]:
+        """Find the most specific route limit for a path"""
+        for route in sorted(ROUTE_RATE_LIMITS, key=len, reverse=True):
+            if path == route or path.startswith(f"{route}/"):
+                return route, ROUTE_RATE_LIMITS[route]
+        return "*", None
+
+    async def check_rate_limit(
+        self, identity: str, path: str, authenticated: bool = False
+    ) -> tuple[bool, int, int, int]:
+        """Returns (allowed, limit, remaining, retry_after)"""
+        route, limit = self.route_limit(path)
+        if limit is None:
+            limit = RATE_LIMIT_PER_USER if authenticated else RATE_LIMIT_PER_IP
+
+        try:
+            allowed, remaining, retry_after = await self.backend.hit(
+                f"{identity}:{route}", limit, self.window
+            )
+        except Exception as e:
+            # Fail open, an unavailable limiter store must not take the gateway down
+            logger.warning(f"Rate limiter backend error: {str(e)}")
+            return True, limit, limit, 0
 
-    def check_rate_limit(self, client_ip: str, limit: int = 100) -> bool:
-        current_time = datetime.now()
-        if client_ip not in self.requests:
-            self.requests[client_ip] = []
+        return allowed, limit, remaining, retry_after
 
-        # Remove requests older than 1 minute
-        self.requests[client_ip] = [
-            req_time
-            for req_time in self.requests[client_ip]
-            if (current_time - req_time).seconds < 60
-        ]
 
-        if len(self.requests[client_ip]) >= limit:
-            return False
+rate_limiter = RateLimiter(create_rate_limit_backend())
 
-        self.requests[client_ip].append(current_time)
-        return True
 
+async def rate_limit_identity(request: Request) -> tuple[str, bool]:
+    """Rate limit authenticated users by user ID and everyone else by IP"""
+    try:
+        user_data = await verify_token(request)
+    except HTTPException:
+        user_data = None
 
-rate_limiter = RateLimiter()
+    if user_data and user_data.get("user_id") is not None:
+        return f"user:{user_data['user_id']}", True
+    return f"ip:{request.client.host}", False
 
 
 # Middleware for logging and rate limiting
@@ -75,8 +340,20 @@ rate_limiter = RateLimiter()
 async def gateway_middleware(request: Request, call_next):
     # Rate limiting
     client_ip = request.client.host
-    if not rate_limiter.check_rate_limit(client_ip):
-        return JSONResponse(status_code=429, content={"detail": "Too many requests"})
+    identity, authenticated = await rate_limit_identity(request)
+    allowed, limit, remaining, retry_after = await rate_limiter.check_rate_limit(
+        identity, request.url.path, authenticated
+    )
+    if not allowed:
+        return JSONResponse(
+            status_code=429,
+            content={"detail": "Too many requests"},
+            headers={
+                "Retry-After": str(retry_after),
+                "X-RateLimit-Limit": str(limit),
+                "X-RateLimit-Remaining": "0",
+            },
+        )
 
     # Log request
     logger.info(f"Request: {request.method} {request.url.path} from {client_ip}")
@@ -90,9 +367,104 @@ async def gateway_middleware(request: Request, call_next):
     logger.info(f"Response: {response.status_code} - Time: {process_time}s")
 
     response.headers["X-Process-Time"] = str(process_time)
+    response.headers["X-RateLimit-Limit"] = str(limit)
+    response.headers["X-RateLimit-Remaining"] = str(remaining)
     return response
 
 
+class TokenVerifier:
+    """
+    Verifies JWTs against the current signing keys and caches the claims
+
+    Verified tokens are cached by SHA-256 digest until their exp, so a token
+    presented repeatedly is only decoded once. Signing keys are SECRET_KEY
+    plus, when set, the keys in JWT_KEYS_FILE (a JSON object of kid -> secret)
+    which is reloaded on change so keys can be rotated without a restart.
+    """
+
+    def __init__(self, max_entries: int = JWT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.cache: OrderedDict[bytes, tuple[dict, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.keys: Dict[str, bytes] = {"default": SECRET_KEY.encode()}
+        self.keys_mtime: Optional[float] = None
+        self.keys_checked_at = 0.0
+
+    def refresh_keys(self):
+        """Reload JWT_KEYS_FILE if it changed since the last check"""
+        if not JWT_KEYS_FILE:
+            return
+        now = time.monotonic()
+        if now - self.keys_checked_at < JWT_KEYS_RELOAD_INTERVAL:
+            return
+        self.keys_checked_at = now
+
+        try:
+            mtime = os.stat(JWT_KEYS_FILE).st_mtime
+            if mtime == self.keys_mtime:
+                return
+            with open(JWT_KEYS_FILE) as f:
+                keys = {kid: secret.encode() for kid, secret in json.load(f).items()}
+        except (OSError, ValueError, AttributeError) as e:
+            logger.error(f"Failed to load JWT keys from {JWT_KEYS_FILE}: {str(e)}")
+            return
+
+        if keys:
+            # user-service signs with SECRET_KEY and no kid, it must stay valid
+            self.keys = {"default": SECRET_KEY.encode()}
+            self.keys.update(
+                (kid, secret) for kid, secret in keys.items() if kid != "default"
+            )
+            self.keys_mtime = mtime
+            # Tokens signed with a retired key must not stay valid in the cache
+            self.cache.clear()
+            logger.info(f"Loaded {len(self.keys) - 1} JWT signing keys from file")
+
+    def decode(self, token: str) -> dict:
+        kid = jwt.get_unverified_header(token).get("kid")
+        candidates = [self.keys[kid]] if kid in self.keys else self.keys.values()
+        for key in candidates:
+            try:
+                return jwt.decode(token, key, algorithms=[ALGORITHM])
+            except jwt.InvalidSignatureError:
+                continue
+        raise jwt.InvalidSignatureError("Signature verification failed")
+
+    def verify(self, token: str) -> dict:
+        self.refresh_keys()
+        digest = hashlib.sha256(token.encode()).digest()
+        now = time.time()
+
+        cached = self.cache.get(digest)
+        if cached and cached[1] > now:
+            self.hits += 1
+            self.cache.move_to_end(digest)
+            return cached[0]
+
+        self.misses += 1
+        payload = self.decode(token)
+        expires_at = payload.get("exp", now + JWT_CACHE_MAX_TTL)
+        self.cache[digest] = (payload, expires_at)
+        self.cache.move_to_end(digest)
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+        return payload
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "signing_keys": len(self.keys),
+        }
+
+
+token_verifier = TokenVerifier()
+
+
 async def verify_token(request: Request) -> Optional[dict]:
     """Verify JWT token from Authorization header"""
     auth_header = request.headers.get("Authorization")
@@ -101,7 +473,7 @@ async def verify_token(request: Request) -> Optional[dict]:
 
     token = auth_header.split(" ")[1]
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = token_verifier.verify(token)
         return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
@@ -109,30 +481,157 @@ async def verify_token(request: Request) -> Optional[dict]:
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
-async def proxy_request(
+# ===== CIRCUIT BREAKERS =====
+class CircuitBreaker:
+    """
+    Per-service circuit breaker
+
+    closed: requests flow, consecutive failures are counted.
+    open: requests fail fast until the recovery timeout has passed.
+    half_open: a single probe request decides between closed and open.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        recovery_timeout: float = CIRCUIT_RECOVERY_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        # Start of the half-open probe, None when no probe is in flight
+        self.probe_started_at: Optional[float] = None
+
+    def allow_request(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self.probe_started_at = None
+
+        if self.state == self.HALF_OPEN:
+            # A probe that never reported back (e.g. cancelled) is replaced
+            now = time.monotonic()
+            if (
+                self.probe_started_at is not None
+                and now - self.probe_started_at < self.recovery_timeout
+            ):
+                return False
+            self.probe_started_at = now
+
+        return True
+
+    def retry_after(self) -> int:
+        remaining = self.recovery_timeout - (time.monotonic() - self.opened_at)
+        return max(1, int(remaining))
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probe_started_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        self.probe_started_at = None
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(
+                    f"Circuit for {self.name} service opened after "
+                    f"{self.failures} failures"
+                )
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of the request volume
+
+    Every request deposits RETRY_BUDGET_RATIO of a retry, every retry
+    withdraws a whole one, so retries cannot multiply load on a struggling
+    service. The balance starts at (and is capped by) RETRY_BUDGET_MIN.
+    """
+
+    def __init__(
+        self, ratio: float = RETRY_BUDGET_RATIO, max_balance: float = RETRY_BUDGET_MIN
+    ):
+        self.ratio = ratio
+        self.max_balance = max_balance
+        self.balance = max_balance
+
+    def record_request(self):
+        self.balance = min(self.max_balance, self.balance + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        if self.balance < 1:
+            return False
+        self.balance -= 1
+        return True
+
+
+circuit_breakers = {name: CircuitBreaker(name) for name in SERVICE_REGISTRY}
+retry_budgets = {name: RetryBudget() for name in SERVICE_REGISTRY}
+
+
+def forwarded_response_headers(response: httpx.Response) -> Dict[str, str]:
+    """Select the upstream response headers that are safe to pass through"""
+    return {
+        key: value
+        for key, value in response.headers.items()
+        if key.lower() in FORWARDED_RESPONSE_HEADERS
+    }
+
+
+def streaming_response(response: httpx.Response) -> StreamingResponse:
+    """Forward an upstream response opened with stream=True as raw bytes"""
+    return StreamingResponse(
+        response.aiter_raw(),
+        status_code=response.status_code,
+        headers=forwarded_response_headers(response),
+        background=BackgroundTask(response.aclose),
+    )
+
+
+async def authenticate(request: Request, require_auth: bool) -> Optional[dict]:
+    """Authentication check"""
+    if not require_auth:
+        return None
+
+    user_data = await verify_token(request)
+    if not user_data:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    return user_data
+
+
+async def send_upstream(
     service_name: str,
     path: str,
     method: str,
     request: Request,
-    require_auth: bool = False,
-):
-    """Proxy request to appropriate microservice"""
-
-    # Authentication check
-    user_data = None
-    if require_auth:
-        user_data = await verify_token(request)
-        if not user_data:
-            raise HTTPException(status_code=401, detail="Authentication required")
-
-    # Get service URL
-    service_url = SERVICE_REGISTRY.get(service_name)
-    if not service_url:
+    user_data: Optional[dict] = None,
+    stream: bool = False,
+) -> httpx.Response:
+    """Send the incoming request to a microservice and return its response"""
+
+    # Get pooled client for the service
+    client = service_clients.get(service_name)
+    if not client:
         raise HTTPException(status_code=404, detail=f"Service {service_name} not found")
 
     # Prepare request
-    url = f"{service_url}{path}"
-    headers = dict(request.headers)
+    headers = {
+        key: value
+        for key, value in request.headers.items()
+        if key not in HOP_BY_HOP_HEADERS
+    }
     headers.pop("host", None)  # Remove host header
 
     # Add user context to headers
@@ -140,51 +639,437 @@ async def proxy_request(
         headers["X-User-ID"] = str(user_data.get("user_id"))
         headers["X-User-Email"] = user_data.get("email", "")
 
+    # Services pass the remaining budget and request ID on to their own calls
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            # Get request body
-            body = await request.body() if method in ["POST", "PUT", "PATCH"] else None
-
-            response = await client.request(
-                method=method,
-                url=url,
-                headers=headers,
-                params=request.query_params,
-                content=body,
-            )
+        timeout = float(headers.get(DEADLINE_HEADER.lower(), UPSTREAM_TIMEOUT))
+    except ValueError:
+        timeout = UPSTREAM_TIMEOUT
+    if not 0 < timeout < UPSTREAM_TIMEOUT:
+        timeout = UPSTREAM_TIMEOUT
+    headers[DEADLINE_HEADER.lower()] = f"{timeout:.3f}"
+    headers.setdefault(REQUEST_ID_HEADER.lower(), uuid.uuid4().hex)
+
+    # Fail fast while the service's circuit is open
+    breaker = circuit_breakers[service_name]
+    if not breaker.allow_request():
+        raise HTTPException(
+            status_code=503,
+            detail="Service unavailable",
+            headers={"Retry-After": str(breaker.retry_after())},
+        )
+
+    # Get request body
+    body = await request.body() if method in ["POST", "PUT", "PATCH"] else None
+
+    upstream_request = client.build_request(
+        method=method,
+        url=path,
+        headers=headers,
+        params=request.query_params,
+        content=body,
+        timeout=timeout,
+    )
 
-            return JSONResponse(
-                content=response.json() if response.text else {},
-                status_code=response.status_code,
-            )
-    except httpx.TimeoutException:
+    # Only idempotent requests are retried, within the service's retry budget
+    budget = retry_budgets[service_name]
+    budget.record_request()
+    idempotent = method == "GET" or "idempotency-key" in headers
+    max_attempts = 1 + (UPSTREAM_MAX_RETRIES if idempotent else 0)
+
+    for attempt in range(1, max_attempts + 1):
+        try:
+            response = await client.send(upstream_request, stream=stream)
+        except httpx.RequestError as e:
+            breaker.record_failure()
+            error = e
+        else:
+            if response.status_code < 500:
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+            error = None
+
+        can_retry = (
+            attempt < max_attempts and budget.try_withdraw() and breaker.allow_request()
+        )
+        if not can_retry:
+            break
+        if error is None:
+            await response.aclose()
+        await asyncio.sleep(UPSTREAM_RETRY_BACKOFF * 2 ** (attempt - 1))
+
+    if error is None:
+        # Upstream answered with a server error, pass it through
+        return response
+    if isinstance(error, httpx.TimeoutException):
         logger.error(f"Timeout calling {service_name} service")
         raise HTTPException(status_code=504, detail="Service timeout")
-    except httpx.RequestError as e:
-        logger.error(f"Error calling {service_name} service: {str(e)}")
-        raise HTTPException(status_code=503, detail="Service unavailable")
+    logger.error(f"Error calling {service_name} service: {str(error)}")
+    raise HTTPException(status_code=503, detail="Service unavailable")
+
+
+# ===== REQUEST COALESCING =====
+class UpstreamResult:
+    """A fully buffered upstream response that can be shared between requests"""
+
+    def __init__(self, status_code: int, headers: Dict[str, str], body: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+
+    def to_response(self) -> Response:
+        return Response(
+            content=self.body, status_code=self.status_code, headers=self.headers
+        )
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent identical calls
+
+    The first caller for a key (the leader) runs the call, callers arriving
+    while it is in flight await the leader's result instead of running it
+    again. A leader may resolve followers with None when its result cannot
+    be shared, followers then have to make their own call.
+    """
+
+    def __init__(self):
+        self.in_flight: Dict[str, asyncio.Future] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: str, fn):
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.followers += 1
+            # Shielded so a disconnecting follower cannot cancel the others
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        self.leaders += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.set_result(None)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved when there are no followers
+            raise
+        finally:
+            del self.in_flight[key]
+
+        future.set_result(None if isinstance(result, httpx.Response) else result)
+        return result
+
+    def stats(self) -> dict:
+        calls = self.leaders + self.followers
+        return {
+            "in_flight": len(self.in_flight),
+            "upstream_calls": self.leaders,
+            "coalesced_calls": self.followers,
+            "dedup_ratio": round(self.followers / calls, 4) if calls else 0.0,
+        }
+
+
+single_flight = SingleFlight()
+
+
+def query_key(request: Request) -> str:
+    """Order-independent representation of the query string"""
+    return urlencode(sorted(request.query_params.multi_items()))
+
+
+def header_key(request: Request, names) -> str:
+    """Order-independent representation of the given request headers"""
+    return "|".join(
+        ",".join(
+            sorted(
+                value.strip()
+                for value in request.headers.get(name, "").split(",")
+                if value.strip()
+            )
+        )
+        for name in names
+    )
+
+
+async def fetch_shareable(
+    service_name: str,
+    path: str,
+    request: Request,
+    user_data: Optional[dict] = None,
+):
+    """
+    GET from upstream, buffering the body when it is small enough to share
+
+    Returns an UpstreamResult, or the open streaming httpx.Response when the
+    body size is unknown or above SINGLE_FLIGHT_MAX_BYTES.
+    """
+    response = await send_upstream(
+        service_name, path, "GET", request, user_data, stream=True
+    )
+
+    content_length = response.headers.get("content-length")
+    if content_length is None or int(content_length) > SINGLE_FLIGHT_MAX_BYTES:
+        return response
+
+    try:
+        body = b"".join([chunk async for chunk in response.aiter_raw()])
+    finally:
+        await response.aclose()
+    return UpstreamResult(
+        response.status_code, forwarded_response_headers(response), body
+    )
+
+
+async def coalesced_get(
+    service_name: str,
+    path: str,
+    request: Request,
+    user_data: Optional[dict] = None,
+    generation: int = 0,
+):
+    """
+    GET through single-flight deduplication
+
+    Identical GETs share one upstream call when they target the same service,
+    path and query within the same auth scope: the authenticated user, or
+    "public" for routes that do not require authentication. Followers get
+    the leader's raw response, so the headers that select its content,
+    encoding or a 304 must match too.
+    """
+    scope = f"user:{user_data.get('user_id')}" if user_data else "public"
+    variant = header_key(request, NEGOTIATION_HEADERS)
+    key = f"{service_name}|{scope}|{generation}|{path}?{query_key(request)}|{variant}"
+
+    result = await single_flight.do(
+        key, lambda: fetch_shareable(service_name, path, request, user_data)
+    )
+    if result is None:
+        # The leader's response could not be shared, make our own call
+        result = await send_upstream(
+            service_name, path, "GET", request, user_data, stream=True
+        )
+    return result
+
+
+async def proxy_request(
+    service_name: str,
+    path: str,
+    method: str,
+    request: Request,
+    require_auth: bool = False,
+    stream: bool = False,
+):
+    """
+    Proxy request to appropriate microservice
+
+    With stream=True the upstream body is forwarded chunk-by-chunk as raw
+    bytes together with its status and selected headers, without decoding.
+    GETs are always passed through as raw bytes and coalesced, see
+    coalesced_get.
+    """
+    user_data = await authenticate(request, require_auth)
+
+    if method == "GET":
+        result = await coalesced_get(service_name, path, request, user_data)
+        if isinstance(result, httpx.Response):
+            return streaming_response(result)
+        return result.to_response()
+
+    response = await send_upstream(
+        service_name, path, method, request, user_data, stream=stream
+    )
+
+    if stream:
+        return streaming_response(response)
+
+    return JSONResponse(
+        content=response.json() if response.text else {},
+        status_code=response.status_code,
+    )
+
+
+# ===== RESPONSE CACHE =====
+class CachedResponse:
+    """A cached upstream 200 response with its validator"""
+
+    def __init__(self, body: bytes, headers: Dict[str, str], expires_at: float):
+        self.body = body
+        self.headers = headers
+        self.expires_at = expires_at
+        self.etag = headers.get("etag") or f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self.headers["etag"] = self.etag
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """Weak comparison of If-None-Match against the entry's ETag"""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        etag = self.etag.removeprefix("W/")
+        return any(
+            tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(",")
+        )
+
+    def to_response(self, request: Request, cache_status: str) -> Response:
+        if self.matches(request.headers.get("if-none-match")):
+            return Response(
+                status_code=304,
+                headers={"ETag": self.etag, "X-Cache": cache_status},
+            )
+        return Response(
+            content=self.body,
+            status_code=200,
+            headers={**self.headers, "X-Cache": cache_status},
+        )
+
+
+class ResponseCache:
+    """Bounded LRU cache of upstream responses with a TTL per entry"""
+
+    def __init__(self, max_entries: int, ttl: float, max_entry_bytes: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        self.entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        # Bumped on invalidation so fills started before a write are discarded
+        self.generation = 0
+
+    @staticmethod
+    def key_for(request: Request, path: str) -> str:
+        # Bodies are stored as sent by upstream, so one entry per encoding
+        encoding = header_key(request, ["accept-encoding"])
+        return f"{path}?{query_key(request)}|{encoding}"
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, body: bytes, headers: Dict[str, str], generation: int):
+        if generation != self.generation:
+            return None
+        entry = CachedResponse(body, headers, time.monotonic() + self.ttl)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return entry
+
+    def invalidate(self):
+        self.generation += 1
+        self.entries.clear()
+
+
+product_cache = ResponseCache(
+    max_entries=PRODUCT_CACHE_MAX_ENTRIES,
+    ttl=PRODUCT_CACHE_TTL,
+    max_entry_bytes=PRODUCT_CACHE_MAX_ENTRY_BYTES,
+)
+
+
+async def cached_proxy_request(
+    cache: ResponseCache, service_name: str, path: str, request: Request
+):
+    """
+    Proxy a public GET through a response cache
+
+    Hits are served from memory (or as 304 when If-None-Match matches).
+    Concurrent misses are coalesced into one upstream call; 200 responses of
+    known, bounded size are stored, anything else is passed through uncached.
+    """
+    key = cache.key_for(request, path)
+    entry = cache.get(key)
+    if entry:
+        return entry.to_response(request, "HIT")
+
+    generation = cache.generation
+    result = await coalesced_get(service_name, path, request, generation=generation)
+    if isinstance(result, httpx.Response):
+        return streaming_response(result)
+    if result.status_code != 200 or len(result.body) > cache.max_entry_bytes:
+        return result.to_response()
+
+    headers = dict(result.headers)
+    headers["vary"] = ", ".join(filter(None, [headers.get("vary"), "Accept-Encoding"]))
+    entry = cache.set(key, result.body, headers, generation)
+    if entry is None:
+        entry = CachedResponse(result.body, headers, 0.0)
+    return entry.to_response(request, "MISS")
 
 
 # Health check endpoint
+health_cache: Dict[str, object] = {"expires_at": 0.0, "result": None}
+health_lock = asyncio.Lock()
+
+
+async def probe_service(client: httpx.AsyncClient) -> dict:
+    """Probe one service's /health endpoint within the per-probe deadline"""
+    start_time = time.perf_counter()
+    try:
+        response = await asyncio.wait_for(
+            client.get("/health"), timeout=HEALTH_CHECK_TIMEOUT
+        )
+        service_status = "healthy" if response.status_code == 200 else "unhealthy"
+    except Exception:
+        service_status = "unreachable"
+
+    return {
+        "status": service_status,
+        "latency_ms": round((time.perf_counter() - start_time) * 1000, 2),
+    }
+
+
 @app.get("/health")
 async def health_check():
     """Check health of API Gateway and all services"""
-    service_health = {}
-
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        for service_name, service_url in SERVICE_REGISTRY.items():
-            try:
-                response = await client.get(f"{service_url}/health")
-                service_health[service_name] = (
-                    "healthy" if response.status_code == 200 else "unhealthy"
-                )
-            except:
-                service_health[service_name] = "unreachable"
-
+    if health_cache["result"] and health_cache["expires_at"] > time.monotonic():
+        return health_cache["result"]
+
+    # Only one caller refreshes the cache, concurrent callers wait for its result
+    async with health_lock:
+        if health_cache["result"] and health_cache["expires_at"] > time.monotonic():
+            return health_cache["result"]
+
+        service_names = list(service_clients)
+        results = await asyncio.gather(
+            *(probe_service(service_clients[name]) for name in service_names)
+        )
+        for name, service_result in zip(service_names, results):
+            service_result["circuit"] = circuit_breakers[name].state
+
+        result = {
+            "status": "healthy",
+            "timestamp": datetime.now().isoformat(),
+            "services": dict(zip(service_names, results)),
+        }
+        health_cache["result"] = result
+        health_cache["expires_at"] = time.monotonic() + HEALTH_CACHE_TTL
+
+    return result
+
+
+@app.get("/metrics")
+async def gateway_metrics():
+    """Gateway cache and connection statistics"""
     return {
-        "status": "healthy",
-        "timestamp": datetime.now().isoformat(),
-        "services": service_health,
+        "jwt_cache": token_verifier.stats(),
+        "single_flight": single_flight.stats(),
+        "circuits": {
+            name: {"state": breaker.state, "failures": breaker.failures}
+            for name, breaker in circuit_breakers.items()
+        },
+        "retry_budgets": {
+            name: round(budget.balance, 2) for name, budget in retry_budgets.items()
+        },
     }
 
 
@@ -214,26 +1099,42 @@ async def get_user(user_id: int, request: Request):
 # ===== PRODUCT SERVICE ROUTES =====
 @app.get("/api/products")
 async def list_products(request: Request):
-    return await proxy_request("product", "/products", "GET", request)
+    return await cached_proxy_request(product_cache, "product", "/products", request)
+
+
+@app.get("/api/products/feed")
+async def get_product_feed(request: Request):
+    return await cached_proxy_request(
+        product_cache, "product", "/products/feed", request
+    )
 
 
 @app.get("/api/products/{product_id}")
 async def get_product(product_id: int, request: Request):
-    return await proxy_request("product", f"/products/{product_id}", "GET", request)
+    return await cached_proxy_request(
+        product_cache, "product", f"/products/{product_id}", request
+    )
 
 
 @app.post("/api/products")
 async def create_product(request: Request):
-    return await proxy_request(
+    response = await proxy_request(
         "product", "/products", "POST", request, require_auth=True
     )
+    # A rejected or failed write changed nothing, keep the cache
+    if 200 <= response.status_code < 300:
+        product_cache.invalidate()
+    return response
 
 
 @app.put("/api/products/{product_id}")
 async def update_product(product_id: int, request: Request):
-    return await proxy_request(
+    response = await proxy_request(
         "product", f"/products/{product_id}", "PUT", request, require_auth=True
     )
+    if 200 <= response.status_code < 300:
+        product_cache.invalidate()
+    return response
 
 
 # ===== ORDER SERVICE ROUTES =====
@@ -247,6 +1148,13 @@ async def create_order(request: Request):
     return await proxy_request("order", "/orders", "POST", request, require_auth=True)
 
 
+@app.get("/api/orders/feed")
+async def get_order_feed(request: Request):
+    return await proxy_request(
+        "order", "/orders/feed", "GET", request, require_auth=True
+    )
+
+
 @app.get("/api/orders/{order_id}")
 async def get_order(order_id: int, request: Request):
     return await proxy_request(
@@ -257,8 +1165,9 @@ async def get_order(order_id: int, request: Request):
 # ===== PAYMENT SERVICE ROUTES =====
 @app.post("/api/payments")
 async def create_payment(request: Request):
+    # Streamed so Retry-After and Preference-Applied reach async clients
     return await proxy_request(
-        "payment", "/payments", "POST", request, require_auth=True
+        "payment", "/payments", "POST", request, require_auth=True, stream=True
     )
 
 
@@ -269,6 +1178,13 @@ async def get_payment(payment_id: int, request: Request):
     )
 
 
+@app.get("/api/payments/{payment_id}/events")
+async def payment_events(payment_id: int, request: Request):
+    return await proxy_request(
+        "payment", f"/payments/{payment_id}/events", "GET", request, require_auth=True
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
 
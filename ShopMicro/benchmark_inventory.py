@@ -0,0 +1,125 @@
+"""
+Concurrency benchmark for inventory reservations
+Fires many concurrent reservations at a single product and verifies that
+the inventory service never oversells it
+
+Usage: python benchmark_inventory.py [--requests 2000] [--concurrency 100]
+"""
+
+import argparse
+import asyncio
+import time
+from typing import List
+
+import httpx
+
+INVENTORY_URL = "http://localhost:8006"
+
+
+class Colors:
+    GREEN = "\033[92m"
+    RED = "\033[91m"
+    BLUE = "\033[94m"
+    END = "\033[0m"
+
+
+async def get_level(client: httpx.AsyncClient, product_id: int) -> dict:
+    """
+    Current stock of a product
+
+    available_quantity counts units still leased to hot-SKU ledger workers
+    (the inventory row alone is short by those), so the before/after
+    comparison holds without waiting for idle leases to be returned.
+    """
+    response = await client.post(
+        f"{INVENTORY_URL}/inventory/batch", json={"product_ids": [product_id]}
+    )
+    response.raise_for_status()
+    return response.json()[0]
+
+
+async def run_benchmark(product_id: int, stock: int, requests: int, concurrency: int):
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(timeout=30.0, limits=limits) as client:
+        response = await client.post(
+            f"{INVENTORY_URL}/inventory/restock",
+            json={"product_id": product_id, "quantity": stock},
+        )
+        response.raise_for_status()
+        before = await get_level(client, product_id)
+
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies: List[float] = []
+        statuses: List[int] = []
+
+        async def reserve(order_id: int):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(
+                    f"{INVENTORY_URL}/inventory/reserve",
+                    json={
+                        "product_id": product_id,
+                        "quantity": 1,
+                        "order_id": order_id,
+                    },
+                )
+                latencies.append(time.perf_counter() - started)
+                statuses.append(response.status_code)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(reserve(i) for i in range(requests)))
+        elapsed = time.perf_counter() - started
+
+        after = await get_level(client, product_id)
+
+    succeeded = statuses.count(200)
+    rejected = statuses.count(400)
+    errors = len(statuses) - succeeded - rejected
+    expected = min(requests, before["available_quantity"])
+    latencies.sort()
+
+    print(f"{Colors.BLUE}Requests: {requests} @ concurrency {concurrency}{Colors.END}")
+    print(f"Throughput: {requests / elapsed:.0f} req/s over {elapsed:.2f}s")
+    print(
+        f"Latency p50: {latencies[len(latencies) // 2] * 1000:.1f}ms, "
+        f"p99: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms"
+    )
+    print(f"Reserved: {succeeded}, rejected: {rejected}, errors: {errors}")
+    print(f"Available: {before['available_quantity']} -> {after['available_quantity']}")
+    print(f"Reserved: {before['reserved_quantity']} -> {after['reserved_quantity']}")
+
+    checks = [
+        (succeeded == expected, f"exactly {expected} reservations succeeded"),
+        (after["available_quantity"] >= 0, "available quantity never negative"),
+        (
+            # Row plus outstanding leases, as reported by /inventory/batch
+            after["available_quantity"] == before["available_quantity"] - succeeded,
+            "available quantity matches successful reservations",
+        ),
+        (
+            after["reserved_quantity"] == before["reserved_quantity"] + succeeded,
+            "reserved quantity matches successful reservations",
+        ),
+    ]
+    ok = True
+    for passed, message in checks:
+        if passed:
+            print(f"{Colors.GREEN}✓ {message}{Colors.END}")
+        else:
+            ok = False
+            print(f"{Colors.RED}✗ {message}{Colors.END}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--product-id", type=int, default=1)
+    parser.add_argument("--stock", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+
+    ok = asyncio.run(
+        run_benchmark(args.product_id, args.stock, args.requests, args.concurrency)
+    )
+    raise SystemExit(0 if ok else 1)
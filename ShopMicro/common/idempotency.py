@@ -0,0 +1,219 @@
+"""
+Idempotency-Key support shared by ShopMicro services
+
+A create endpoint runs its handler through IdempotencyStore.run, keyed by
+the caller and the Idempotency-Key header, so retries of the same request
+get the first response back instead of creating a second resource.
+"""
+
+from datetime import datetime, timedelta
+from fastapi import HTTPException, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy import Column, DateTime, Integer, String, Text, and_, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from typing import Awaitable, Callable, Dict, Optional, Type
+import asyncio
+import hashlib
+import json
+import os
+
+# Stored responses and in-flight locks
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "60.0"))
+
+
+class IdempotencyKeyMixin:
+    """Columns of a service's idempotency_keys table"""
+
+    key = Column(String, primary_key=True)  # <user_id>:<Idempotency-Key>
+    fingerprint = Column(String, nullable=False)  # Hash of the request body
+    status_code = Column(Integer, nullable=True)  # Null while in flight
+    response_body = Column(Text, nullable=True)
+    response_headers = Column(Text, nullable=True)
+    locked_until = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+def request_fingerprint(data: BaseModel) -> str:
+    body = json.dumps(jsonable_encoder(data), sort_keys=True)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Responses stored by Idempotency-Key
+
+    The first request with a key inserts it, which locks the key while that
+    request is in flight. Retries get the stored response back instead of
+    running the request again. A lock left by a crashed request expires after
+    lock_timeout, stored responses after ttl. Reads and writes of the keys
+    run in worker threads, off the event loop.
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker,
+        model: Type[IdempotencyKeyMixin],
+        ttl: float = IDEMPOTENCY_TTL,
+        lock_timeout: float = IDEMPOTENCY_LOCK_TIMEOUT,
+    ):
+        self.session_factory = session_factory
+        self.model = model
+        self.ttl = timedelta(seconds=ttl)
+        self.lock_timeout = timedelta(seconds=lock_timeout)
+        self.purged_at = datetime.min
+
+    async def run(
+        self,
+        key: str,
+        fingerprint: str,
+        response: Response,
+        status_code: int,
+        handler: Callable[[], Awaitable],
+    ):
+        """Run handler once for the key and replay its response to retries"""
+        if len(key) > 255:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Idempotency-Key is too long",
+            )
+
+        record = await asyncio.to_thread(self.claim, key, fingerprint)
+        if record is not None:
+            return JSONResponse(
+                status_code=record.status_code,
+                content=json.loads(record.response_body),
+                headers={
+                    **json.loads(record.response_headers),
+                    "Idempotent-Replayed": "true",
+                },
+            )
+
+        try:
+            result = await handler()
+        except HTTPException as e:
+            # Server errors are not final, a retry runs the request again
+            if e.status_code >= 500:
+                await asyncio.to_thread(self.release, key)
+            else:
+                await asyncio.to_thread(
+                    self.complete, key, e.status_code, {"detail": e.detail}, e.headers
+                )
+            raise
+        except BaseException:
+            await asyncio.to_thread(self.release, key)
+            raise
+
+        headers = {
+            name: value
+            for name, value in response.headers.items()
+            if name != "content-length"
+        }
+        await asyncio.to_thread(
+            self.complete,
+            key,
+            response.status_code or status_code,
+            jsonable_encoder(result),
+            headers,
+        )
+        return result
+
+    def claim(self, key: str, fingerprint: str) -> Optional[IdempotencyKeyMixin]:
+        """Lock the key for this request, or return the response stored for it"""
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            if now - self.purged_at > timedelta(minutes=1):
+                self.purged_at = now
+                db.query(self.model).filter(self.model.expires_at <= now).delete(
+                    synchronize_session=False
+                )
+                db.commit()
+
+            lock = {
+                "fingerprint": fingerprint,
+                "status_code": None,
+                "response_body": None,
+                "response_headers": None,
+                "locked_until": now + self.lock_timeout,
+                "expires_at": now + self.ttl,
+            }
+            db.add(self.model(key=key, **lock))
+            try:
+                db.commit()
+                return None
+            except IntegrityError:
+                db.rollback()
+
+            # Take over the key if it expired or its request was abandoned
+            taken = db.execute(
+                update(self.model)
+                .where(
+                    self.model.key == key,
+                    or_(
+                        self.model.expires_at <= now,
+                        and_(
+                            self.model.status_code.is_(None),
+                            self.model.locked_until <= now,
+                        ),
+                    ),
+                )
+                .values(**lock)
+            )
+            db.commit()
+            if taken.rowcount:
+                return None
+
+            record = db.query(self.model).filter(self.model.key == key).first()
+            if record is not None and record.fingerprint != fingerprint:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+                    detail="Idempotency-Key was already used for a different request",
+                )
+            if record is None or record.status_code is None:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="A request with this Idempotency-Key is in progress",
+                    headers={"Retry-After": "1"},
+                )
+            db.expunge(record)
+            return record
+        finally:
+            db.close()
+
+    def complete(
+        self,
+        key: str,
+        status_code: int,
+        body,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        """Store the response and unlock the key"""
+        db = self.session_factory()
+        try:
+            db.execute(
+                update(self.model)
+                .where(self.model.key == key)
+                .values(
+                    status_code=status_code,
+                    response_body=json.dumps(body),
+                    response_headers=json.dumps(headers or {}),
+                )
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def release(self, key: str):
+        """Drop the lock without a stored response so the key can be retried"""
+        db = self.session_factory()
+        try:
+            db.query(self.model).filter(
+                self.model.key == key, self.model.status_code.is_(None)
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
@@ -0,0 +1,267 @@
+"""
+Transactional outbox shared by ShopMicro services
+
+A service stages events in the same transaction as the change they
+describe, and an OutboxRelay publishes committed events to the event
+broker in batches. Delivery is at-least-once; consumers de-duplicate on
+event_id.
+"""
+
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from sqlalchemy import Column, DateTime, Integer, String, Text, or_
+from sqlalchemy.orm import Session, sessionmaker
+from typing import List, Optional, Type
+from common.service_client import ServiceClients
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import uuid
+
+# Notification events: staged in the outbox, relayed to the event broker
+EVENT_BROKER = os.getenv("EVENT_BROKER", "http")  # http, sqlite, redis
+EVENT_STREAM = os.getenv("EVENT_STREAM", "shopmicro:notifications")
+# On the events-data volume shared with notification-service
+EVENT_SQLITE_PATH = os.getenv("EVENT_SQLITE_PATH", "/data/events.db")
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+# notification-service trims acked entries off the Redis stream; this caps its
+# length (approximately) should that stop happening. 0 disables the cap
+EVENT_STREAM_MAXLEN = int(os.getenv("EVENT_STREAM_MAXLEN", "1000000"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0"))
+# A claimed batch not published within this long is picked up again
+OUTBOX_CLAIM_TIMEOUT = float(os.getenv("OUTBOX_CLAIM_TIMEOUT", "30.0"))
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxEventMixin:
+    """Columns of a service's outbox_events table"""
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_id = Column(String, nullable=False, default=lambda: uuid.uuid4().hex)
+    event_type = Column(String, nullable=False)  # notification
+    payload = Column(Text, nullable=False)  # JSON event body
+    claimed_until = Column(DateTime, nullable=True)  # Set while being published
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class EventPublisher(ABC):
+    """Delivers a batch of outbox events to the event broker"""
+
+    @abstractmethod
+    async def publish(self, events: List[dict]):
+        """Deliver every event or raise"""
+
+    async def close(self):
+        pass
+
+
+class HttpEventPublisher(EventPublisher):
+    """Posts batches straight to notification-service"""
+
+    def __init__(self, clients: ServiceClients):
+        self.clients = clients
+
+    async def publish(self, events: List[dict]):
+        response = await self.clients.post(
+            "notification", "/notifications/events", json={"events": events}
+        )
+        response.raise_for_status()
+
+
+class SQLiteEventPublisher(EventPublisher):
+    """Appends batches to a SQLite queue file shared with notification-service"""
+
+    def __init__(self, path: str = EVENT_SQLITE_PATH, stream: str = EVENT_STREAM):
+        self.path = path
+        self.stream = stream
+
+    def append(self, events: List[dict]):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS event_queue ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "stream TEXT NOT NULL, body TEXT NOT NULL)"
+            )
+            conn.executemany(
+                "INSERT INTO event_queue (stream, body) VALUES (?, ?)",
+                [(self.stream, json.dumps(event)) for event in events],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    async def publish(self, events: List[dict]):
+        await asyncio.to_thread(self.append, events)
+
+
+class RedisEventPublisher(EventPublisher):
+    """Appends batches to a Redis stream in one pipelined round trip"""
+
+    def __init__(
+        self,
+        redis_url: str = REDIS_URL,
+        stream: str = EVENT_STREAM,
+        maxlen: int = EVENT_STREAM_MAXLEN,
+    ):
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(redis_url)
+        self.stream = stream
+        self.maxlen = maxlen or None
+
+    async def publish(self, events: List[dict]):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for event in events:
+                pipe.xadd(
+                    self.stream,
+                    {"event": json.dumps(event)},
+                    maxlen=self.maxlen,
+                    approximate=True,
+                )
+            await pipe.execute()
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+def create_event_publisher(clients: ServiceClients) -> EventPublisher:
+    if EVENT_BROKER == "redis":
+        return RedisEventPublisher()
+    if EVENT_BROKER == "sqlite":
+        return SQLiteEventPublisher()
+    return HttpEventPublisher(clients)
+
+
+class OutboxRelay:
+    """
+    Publishes committed outbox events to the broker in batches
+
+    Wakes up as soon as a request commits new events and otherwise polls,
+    so events left behind by a crash are still sent. A batch is claimed
+    with SKIP LOCKED and the claim committed before publishing, so no row
+    locks are held across the broker round trip; the rows are deleted in a
+    second transaction once the broker has accepted them. A claim that is
+    neither deleted nor released within claim_timeout (the relay died
+    mid-publish) lets another relay pick the batch up again.
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker,
+        model: Type[OutboxEventMixin],
+        clients: ServiceClients,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        poll_interval: float = OUTBOX_POLL_INTERVAL,
+        claim_timeout: float = OUTBOX_CLAIM_TIMEOUT,
+    ):
+        self.session_factory = session_factory
+        self.model = model
+        self.clients = clients
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.claim_timeout = claim_timeout
+        self.publisher: Optional[EventPublisher] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def add(self, db: Session, event_type: str, payload: dict):
+        """Stage an event in the caller's transaction; it is relayed after commit"""
+        db.add(self.model(event_type=event_type, payload=json.dumps(payload)))
+
+    async def start(self):
+        self.publisher = create_event_publisher(self.clients)
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        await self.publisher.close()
+
+    def notify(self):
+        if self.wakeup:
+            self.wakeup.set()
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+            try:
+                while await self.publish_batch() == self.batch_size:
+                    pass
+            except Exception:
+                logger.exception("Failed to relay outbox events")
+
+    async def publish_batch(self) -> int:
+        ids, events = await asyncio.to_thread(self.claim)
+        if not ids:
+            return 0
+
+        try:
+            await self.publisher.publish(events)
+        except Exception:
+            await asyncio.to_thread(self.finish, ids, False)
+            raise
+
+        await asyncio.to_thread(self.finish, ids, True)
+        return len(ids)
+
+    def claim(self):
+        """Claim the next batch of unclaimed or abandoned events"""
+        now = datetime.utcnow()
+        db = self.session_factory()
+        try:
+            rows = (
+                db.query(self.model)
+                .filter(
+                    or_(
+                        self.model.claimed_until.is_(None),
+                        self.model.claimed_until < now,
+                    )
+                )
+                .order_by(self.model.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            claimed_until = now + timedelta(seconds=self.claim_timeout)
+            events = []
+            for row in rows:
+                row.claimed_until = claimed_until
+                events.append(
+                    {
+                        "event_id": row.event_id,
+                        "event_type": row.event_type,
+                        "payload": json.loads(row.payload),
+                    }
+                )
+            ids = [row.id for row in rows]
+            db.commit()
+            return ids, events
+        finally:
+            db.close()
+
+    def finish(self, ids: List[int], published: bool):
+        """Delete published events, or release the claim so they are retried"""
+        db = self.session_factory()
+        try:
+            rows = db.query(self.model).filter(self.model.id.in_(ids))
+            if published:
+                rows.delete(synchronize_session=False)
+            else:
+                rows.update({"claimed_until": None}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
@@ -0,0 +1,377 @@
+"""
+Shared HTTP client for calls between ShopMicro services
+
+Each service opens one ServiceClients in its lifespan hook and makes every
+inter-service call through it, so connections are pooled per target and
+all calls get the same timeout, error handling and tracing.
+
+Calls made while handling a request share that request's deadline: the
+remaining budget caps each call's timeout and is passed on in
+X-Request-Timeout, so downstream services stop waiting once the caller
+has given up. X-Request-ID is passed along the same way to follow one
+request across services.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi import Request, status
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import httpx
+import logging
+import math
+import os
+import time
+import uuid
+
+# Connection pool and default timeout for every target service
+SERVICE_TIMEOUT = float(os.getenv("SERVICE_TIMEOUT", "10.0"))
+SERVICE_MAX_CONNECTIONS = int(os.getenv("SERVICE_MAX_CONNECTIONS", "100"))
+SERVICE_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("SERVICE_MAX_KEEPALIVE_CONNECTIONS", "20")
+)
+SERVICE_KEEPALIVE_EXPIRY = float(os.getenv("SERVICE_KEEPALIVE_EXPIRY", "30.0"))
+# Calls slower than this are logged
+SERVICE_SLOW_CALL = float(os.getenv("SERVICE_SLOW_CALL", "1.0"))
+
+# Remaining budget of a request in seconds, and its trace ID
+DEADLINE_HEADER = "X-Request-Timeout"
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# Largest batch each service's batch endpoint accepts
+PRODUCT_BATCH_SIZE = 500
+INVENTORY_BATCH_SIZE = 500
+USER_BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+# time.monotonic() by which the current request must be answered
+request_deadline: ContextVar[Optional[float]] = ContextVar(
+    "request_deadline", default=None
+)
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# Called after every call as (service, method, path, status_code, seconds);
+# status_code is None when no response arrived
+CallHook = Callable[[str, str, str, Optional[int], float], None]
+
+
+class ServiceCallError(Exception):
+    """A call to another service failed"""
+
+    def __init__(self, service: str, message: str, status_code: Optional[int] = None):
+        super().__init__(f"{service} service: {message}")
+        self.service = service
+        self.status_code = status_code  # None when no response arrived
+
+
+class DeadlineExceeded(ServiceCallError):
+    """The request's deadline passed before the call could complete"""
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left until the current request's deadline, None without one"""
+    deadline_at = request_deadline.get()
+    if deadline_at is None:
+        return None
+    return deadline_at - time.monotonic()
+
+
+@contextmanager
+def deadline(seconds: float, detached: bool = False) -> Iterator[None]:
+    """
+    Limit calls made inside the block to seconds, within any outer deadline
+
+    Detached work, which must go on after the caller gave up, ignores the
+    outer deadline.
+    """
+    deadline_at = time.monotonic() + seconds
+    outer = None if detached else request_deadline.get()
+    token = request_deadline.set(
+        deadline_at if outer is None else min(outer, deadline_at)
+    )
+    try:
+        yield
+    finally:
+        request_deadline.reset(token)
+
+
+class RequestContextMiddleware:
+    """Picks up the deadline and request ID of incoming requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        deadline_at = None
+        timeout = headers.get(DEADLINE_HEADER.lower().encode())
+        if timeout:
+            try:
+                seconds = float(timeout)
+            except ValueError:
+                seconds = math.nan
+            if math.isfinite(seconds):
+                deadline_at = time.monotonic() + seconds
+        trace_id = headers.get(REQUEST_ID_HEADER.lower().encode(), b"").decode(
+            "latin-1"
+        )
+
+        deadline_token = request_deadline.set(deadline_at)
+        id_token = request_id.set(trace_id or uuid.uuid4().hex)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_id.reset(id_token)
+            request_deadline.reset(deadline_token)
+
+
+async def service_call_error_handler(request: Request, exc: ServiceCallError):
+    """Answer 504 when a call ran out of time, 503 for any other failed call"""
+    if isinstance(exc, DeadlineExceeded) or isinstance(
+        exc.__cause__, httpx.TimeoutException
+    ):
+        status_code = status.HTTP_504_GATEWAY_TIMEOUT
+        detail = f"{exc.service.capitalize()} service timeout"
+    else:
+        status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        detail = f"{exc.service.capitalize()} service unavailable"
+    return JSONResponse(status_code=status_code, content={"detail": detail})
+
+
+# ===== BATCH RESPONSES =====
+class ProductPrice(BaseModel):
+    id: int
+    name: str
+    price: float
+    is_active: bool
+
+
+class InventoryLevel(BaseModel):
+    product_id: int
+    available_quantity: int
+    reserved_quantity: int
+
+
+class UserProfile(BaseModel):
+    id: int
+    email: str
+    username: str
+    full_name: Optional[str] = None
+    is_active: bool
+
+
+class ServiceClients:
+    """
+    Pooled HTTP clients for the services this one calls, keyed by name
+
+    Clients are opened by start() in the lifespan hook and reused for every
+    call. A call's timeout is the default timeout or what is left of the
+    current deadline, whichever is less, and a call made after the deadline
+    fails without being sent. Hooks see the outcome and duration of every
+    call; the built-in one keeps per-service counters for stats().
+    """
+
+    def __init__(self, targets: Dict[str, str], timeout: float = SERVICE_TIMEOUT):
+        self.targets = targets
+        self.timeout = timeout
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+        self.hooks: List[CallHook] = [self.record]
+        self.counters = {
+            name: {"calls": 0, "errors": 0, "seconds": 0.0} for name in targets
+        }
+
+    async def start(self):
+        limits = httpx.Limits(
+            max_connections=SERVICE_MAX_CONNECTIONS,
+            max_keepalive_connections=SERVICE_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=SERVICE_KEEPALIVE_EXPIRY,
+        )
+        self.clients = {
+            name: httpx.AsyncClient(base_url=url, timeout=self.timeout, limits=limits)
+            for name, url in self.targets.items()
+        }
+
+    async def stop(self):
+        await asyncio.gather(*(client.aclose() for client in self.clients.values()))
+        self.clients = {}
+
+    def add_hook(self, hook: CallHook):
+        self.hooks.append(hook)
+
+    async def request(
+        self,
+        service: str,
+        method: str,
+        path: str,
+        *,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+        **kwargs,
+    ) -> httpx.Response:
+        """
+        Send one request to a service within the current deadline
+
+        Responses are returned whatever their status. Raises ServiceCallError
+        when no response arrived, DeadlineExceeded when the deadline ran out.
+        """
+        client = self.clients[service]
+        timeout = timeout or self.timeout
+        remaining = remaining_time()
+        if remaining is not None:
+            if remaining <= 0:
+                self.finish(service, method, path, None, 0.0)
+                raise DeadlineExceeded(service, "deadline exceeded")
+            timeout = min(timeout, remaining)
+
+        headers = {
+            **(headers or {}),
+            DEADLINE_HEADER: f"{timeout:.3f}",
+            REQUEST_ID_HEADER: request_id.get() or uuid.uuid4().hex,
+        }
+        started = time.monotonic()
+        try:
+            response = await client.request(
+                method, path, headers=headers, timeout=timeout, **kwargs
+            )
+        except httpx.TimeoutException as e:
+            self.finish(service, method, path, None, time.monotonic() - started)
+            if remaining is not None and timeout == remaining:
+                raise DeadlineExceeded(service, "deadline exceeded") from e
+            raise ServiceCallError(service, f"timed out after {timeout:.3f}s") from e
+        except httpx.RequestError as e:
+            self.finish(service, method, path, None, time.monotonic() - started)
+            raise ServiceCallError(service, str(e) or e.__class__.__name__) from e
+
+        self.finish(
+            service, method, path, response.status_code, time.monotonic() - started
+        )
+        return response
+
+    async def get(self, service: str, path: str, **kwargs) -> httpx.Response:
+        return await self.request(service, "GET", path, **kwargs)
+
+    async def post(self, service: str, path: str, **kwargs) -> httpx.Response:
+        return await self.request(service, "POST", path, **kwargs)
+
+    async def patch(self, service: str, path: str, **kwargs) -> httpx.Response:
+        return await self.request(service, "PATCH", path, **kwargs)
+
+    async def post_json(self, service: str, path: str, body: dict):
+        """POST and return the JSON body, raising ServiceCallError unless 200"""
+        response = await self.post(service, path, json=body)
+        if response.status_code != status.HTTP_200_OK:
+            raise ServiceCallError(
+                service,
+                f"{path} answered {response.status_code}",
+                response.status_code,
+            )
+        return response.json()
+
+    async def batched(self, ids: List[int], size: int, fetch) -> List:
+        """Run fetch on chunks of at most size unique IDs concurrently"""
+        ids = list(dict.fromkeys(ids))
+        return await asyncio.gather(
+            *(fetch(ids[start : start + size]) for start in range(0, len(ids), size))
+        )
+
+    async def get_products(
+        self, product_ids: List[int]
+    ) -> Tuple[Dict[int, ProductPrice], List[int]]:
+        """Prices of many products by ID, and the IDs that do not exist"""
+
+        async def fetch(chunk: List[int]):
+            return await self.post_json(
+                "product", "/products/batch", {"product_ids": chunk}
+            )
+
+        products: Dict[int, ProductPrice] = {}
+        missing: List[int] = []
+        for batch in await self.batched(product_ids, PRODUCT_BATCH_SIZE, fetch):
+            for product in batch["products"]:
+                products[product["id"]] = ProductPrice(**product)
+            missing.extend(batch["missing"])
+        return products, missing
+
+    async def get_inventory(self, product_ids: List[int]) -> Dict[int, InventoryLevel]:
+        """Stock levels of many products by ID; untracked products are left out"""
+
+        async def fetch(chunk: List[int]):
+            return await self.post_json(
+                "inventory", "/inventory/batch", {"product_ids": chunk}
+            )
+
+        levels: Dict[int, InventoryLevel] = {}
+        for batch in await self.batched(product_ids, INVENTORY_BATCH_SIZE, fetch):
+            for level in batch:
+                levels[level["product_id"]] = InventoryLevel(**level)
+        return levels
+
+    async def get_users(
+        self, user_ids: List[int]
+    ) -> Tuple[Dict[int, UserProfile], List[int]]:
+        """Profiles of many users by ID, and the IDs that do not exist"""
+
+        async def fetch(chunk: List[int]):
+            return await self.post_json("user", "/users/batch", {"user_ids": chunk})
+
+        users: Dict[int, UserProfile] = {}
+        missing: List[int] = []
+        for batch in await self.batched(user_ids, USER_BATCH_SIZE, fetch):
+            for user in batch["users"]:
+                users[user["id"]] = UserProfile(**user)
+            missing.extend(batch["missing"])
+        return users, missing
+
+    def finish(
+        self,
+        service: str,
+        method: str,
+        path: str,
+        status_code: Optional[int],
+        seconds: float,
+    ):
+        for hook in self.hooks:
+            try:
+                hook(service, method, path, status_code, seconds)
+            except Exception:
+                logger.exception("Service call hook failed")
+
+    def record(
+        self,
+        service: str,
+        method: str,
+        path: str,
+        status_code: Optional[int],
+        seconds: float,
+    ):
+        counters = self.counters[service]
+        counters["calls"] += 1
+        counters["seconds"] += seconds
+        if status_code is None or status_code >= 500:
+            counters["errors"] += 1
+        if seconds >= SERVICE_SLOW_CALL:
+            logger.warning(
+                f"Slow call {method} {service}{path}: {seconds:.3f}s "
+                f"(status {status_code}, request {request_id.get()})"
+            )
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                "calls": counters["calls"],
+                "errors": counters["errors"],
+                "avg_ms": (
+                    round(counters["seconds"] / counters["calls"] * 1000, 2)
+                    if counters["calls"]
+                    else 0.0
+                ),
+            }
+            for name, counters in self.counters.items()
+        }
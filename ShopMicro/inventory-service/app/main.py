@@ -1,11 +1,31 @@
-from fastapi import FastAPI, HTTPException, Depends, status
-from sqlalchemy import create_engine, Column, Integer, DateTime, String
+from fastapi import FastAPI, HTTPException, Depends, Query, status
+from contextlib import asynccontextmanager
+from sqlalchemy import (
+    create_engine,
+    case,
+    func,
+    insert,
+    update,
+    tuple_,
+    Column,
+    Integer,
+    DateTime,
+    String,
+    Index,
+)
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, Session
-from pydantic import BaseModel
-from datetime import datetime
-from typing import Optional, List
+from pydantic import BaseModel, Field
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Tuple
+import asyncio
+import base64
+import json
+import logging
 import os
+import socket
+import time
 
 # Database configuration
 DATABASE_URL = os.getenv(
@@ -15,10 +35,35 @@ engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Hot-SKU reservation ledger; disabled unless HOT_SKUS lists product IDs
+HOT_SKUS = {int(p) for p in os.getenv("HOT_SKUS", "").split(",") if p.strip()}
+LEDGER_LEASE_SIZE = int(os.getenv("LEDGER_LEASE_SIZE", "100"))
+LEDGER_FLUSH_INTERVAL = float(os.getenv("LEDGER_FLUSH_INTERVAL", "0.005"))
+LEDGER_LEASE_IDLE_SECONDS = float(os.getenv("LEDGER_LEASE_IDLE_SECONDS", "2.0"))
+# Workers heartbeat this often; one silent for LEDGER_WORKER_TTL is presumed
+# dead and its leases are handed back by the next worker that notices
+LEDGER_HEARTBEAT_INTERVAL = float(os.getenv("LEDGER_HEARTBEAT_INTERVAL", "5.0"))
+LEDGER_WORKER_TTL = float(os.getenv("LEDGER_WORKER_TTL", "30.0"))
+
+logger = logging.getLogger("inventory-service")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if HOT_SKUS:
+        await ledger.start()
+    try:
+        yield
+    finally:
+        if HOT_SKUS:
+            await ledger.stop()
+
+
 app = FastAPI(
     title="Inventory Service",
     description="Inventory management microservice",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 
@@ -44,6 +89,42 @@ class InventoryTransaction(Base):
     reference_id = Column(Integer, nullable=True)  # order_id or other reference
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    # Keyset pagination index for a product's history, newest first
+    __table_args__ = (
+        Index(
+            "ix_inventory_transactions_product_id_created_at_id",
+            "product_id",
+            "created_at",
+            "id",
+        ),
+        # Per-order lookups for idempotent bulk reserve and release
+        Index(
+            "ix_inventory_transactions_reference_id_type",
+            "reference_id",
+            "transaction_type",
+        ),
+    )
+
+
+class LedgerWorker(Base):
+    __tablename__ = "ledger_workers"
+
+    id = Column(Integer, primary_key=True, index=True)  # Owner of "lease" rows
+    name = Column(String, nullable=False)  # hostname:pid
+    heartbeat_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    # IDs are never reused, so a stale process cannot pass for a new worker
+    __table_args__ = {"sqlite_autoincrement": True}
+
+
+class LedgerLease(Base):
+    __tablename__ = "ledger_leases"
+
+    # Units of a product's stock a ledger worker currently holds
+    worker_id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, primary_key=True, index=True)
+    units = Column(Integer, nullable=False, default=0)
+
 
 # Create tables
 Base.metadata.create_all(bind=engine)
@@ -75,12 +156,39 @@ class InventoryResponse(BaseModel):
         from_attributes = True
 
 
+class InventoryBatchRequest(BaseModel):
+    product_ids: List[int] = Field(..., min_length=1, max_length=500)
+
+
+class InventoryLevel(BaseModel):
+    product_id: int
+    available_quantity: int
+    reserved_quantity: int
+
+    class Config:
+        from_attributes = True
+
+
 class ReserveRequest(BaseModel):
     product_id: int
-    quantity: int
+    quantity: int = Field(..., gt=0)
+    order_id: Optional[int] = None
+
+
+class ReserveItem(BaseModel):
+    product_id: int
+    quantity: int = Field(..., gt=0)
+
+
+class BulkReserveRequest(BaseModel):
+    items: List[ReserveItem] = Field(..., min_length=1, max_length=500)
     order_id: Optional[int] = None
 
 
+class BulkReleaseRequest(BaseModel):
+    order_id: int
+
+
 class RestockRequest(BaseModel):
     product_id: int
     quantity: int
@@ -98,6 +206,11 @@ class TransactionResponse(BaseModel):
         from_attributes = True
 
 
+class TransactionPage(BaseModel):
+    items: List[TransactionResponse]
+    next_cursor: Optional[str] = None
+
+
 # ===== DEPENDENCIES =====
 def get_db():
     db = SessionLocal()
@@ -108,12 +221,30 @@ def get_db():
 
 
 # ===== UTILITY FUNCTIONS =====
+def encode_cursor(created_at: datetime, id: int) -> str:
+    """Opaque cursor pointing just after the row with (created_at, id)"""
+    raw = json.dumps([created_at.isoformat(), id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(id)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+
+
 def create_transaction(
     db: Session,
     product_id: int,
     transaction_type: str,
     quantity: int,
     reference_id: Optional[int] = None,
+    commit: bool = True,
 ):
     """Create an inventory transaction record"""
     transaction = InventoryTransaction(
@@ -123,7 +254,432 @@ def create_transaction(
         reference_id=reference_id,
     )
     db.add(transaction)
-    db.commit()
+    if commit:
+        db.commit()
+
+
+def update_stock(
+    db: Session, product_id: int, guard=None, available: int = 0, reserved: int = 0
+):
+    """
+    Atomically apply quantity deltas to a product's inventory row
+
+    The guard is evaluated by the database as part of the same UPDATE, so
+    concurrent requests serialize on the row and can never oversell. Returns
+    the new (available_quantity, reserved_quantity), or None when the row
+    does not exist or the guard did not hold.
+    """
+    statement = update(Inventory).where(Inventory.product_id == product_id)
+    if guard is not None:
+        statement = statement.where(guard)
+    return db.execute(
+        statement.values(
+            available_quantity=Inventory.available_quantity + available,
+            reserved_quantity=Inventory.reserved_quantity + reserved,
+            updated_at=datetime.utcnow(),
+        ).returning(Inventory.available_quantity, Inventory.reserved_quantity)
+    ).first()
+
+
+def order_reservations(db: Session, order_id: int) -> Dict[int, int]:
+    """Units still reserved for an order per product, from the transaction log"""
+    outstanding = func.sum(
+        case(
+            (
+                InventoryTransaction.transaction_type == "reserve",
+                InventoryTransaction.quantity,
+            ),
+            else_=-InventoryTransaction.quantity,
+        )
+    )
+    rows = (
+        db.query(InventoryTransaction.product_id, outstanding)
+        .filter(
+            InventoryTransaction.reference_id == order_id,
+            InventoryTransaction.transaction_type.in_(["reserve", "release", "sold"]),
+        )
+        .group_by(InventoryTransaction.product_id)
+        .all()
+    )
+    return {product_id: quantity for product_id, quantity in rows if quantity > 0}
+
+
+def leased_units(db: Session, product_ids) -> Dict[int, int]:
+    """
+    Units of each product leased to ledger workers
+
+    Leased stock has left available_quantity but is still unreserved, so it
+    is added back to every available quantity reported to callers.
+    """
+    rows = (
+        db.query(LedgerLease.product_id, func.sum(LedgerLease.units))
+        .filter(LedgerLease.product_id.in_(set(product_ids)))
+        .group_by(LedgerLease.product_id)
+        .all()
+    )
+    return {product_id: units for product_id, units in rows if units}
+
+
+# ===== HOT-SKU LEDGER =====
+class LedgerEntry:
+    def __init__(self):
+        self.leased = 0  # Units taken from the inventory row, not yet reserved
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()  # Serializes lease refills
+
+
+class ReservationLedger:
+    """
+    In-process reservation counters for hot SKUs
+
+    Each worker leases a block of a product's available stock and serves
+    reservations for it from memory. Accepted reservations are group-committed
+    every flush interval: one transaction moves the units to reserved_quantity
+    and journals a "reserve" row per order, and requests are answered only
+    once that batch is durable.
+
+    Every worker process registers its own ledger_workers row on start and
+    heartbeats it; the row's ID owns the worker's ledger_leases balances.
+    "lease" journal rows record stock moving in and out of leases without a
+    reference_id, which only ever holds order IDs. Leases of a worker that
+    stopped heartbeating for worker_ttl are handed back by whichever live
+    worker notices first, and a worker that finds itself presumed dead drops
+    its leases and registers again.
+    """
+
+    def __init__(
+        self,
+        lease_size: int,
+        flush_interval: float,
+        idle_seconds: float,
+        heartbeat_interval: float,
+        worker_ttl: float,
+    ):
+        self.worker_id: Optional[int] = None
+        self.lease_size = lease_size
+        self.flush_interval = flush_interval
+        self.idle_seconds = idle_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_ttl = worker_ttl
+        self.entries: Dict[int, LedgerEntry] = {}
+        self.pending: List[Tuple[int, int, Optional[int], asyncio.Future]] = []
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.last_heartbeat = 0.0
+
+    async def start(self):
+        self.wakeup = asyncio.Event()
+        self.worker_id = await asyncio.to_thread(self.register)
+        self.last_heartbeat = time.monotonic()
+        await asyncio.to_thread(self.recover)
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+        for product_id in list(self.entries):
+            await self.return_lease(product_id)
+        await asyncio.to_thread(self.unregister)
+
+    async def reserve(
+        self, product_id: int, quantity: int, order_id: Optional[int]
+    ) -> Optional[int]:
+        """
+        Reserve from the worker's lease
+
+        Returns the product's available stock across all workers once the
+        reservation is durable, or None if the lease cannot cover the quantity.
+        """
+        entry = self.entries.setdefault(product_id, LedgerEntry())
+        entry.last_used = time.monotonic()
+
+        if entry.leased < quantity:
+            async with entry.lock:
+                if entry.leased < quantity:
+                    want = max(self.lease_size, quantity - entry.leased)
+                    entry.leased += await asyncio.to_thread(
+                        self.take_lease, product_id, want
+                    )
+            if entry.leased < quantity:
+                return None
+
+        entry.leased -= quantity
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((product_id, quantity, order_id, future))
+        self.wakeup.set()
+        return await future
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self.wakeup.wait(), min(self.idle_seconds, self.heartbeat_interval)
+                )
+                # Give concurrent requests a moment to join this batch
+                await asyncio.sleep(self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+            now = time.monotonic()
+            for product_id, entry in list(self.entries.items()):
+                if entry.leased and now - entry.last_used > self.idle_seconds:
+                    await self.return_lease(product_id)
+            if now - self.last_heartbeat >= self.heartbeat_interval:
+                self.last_heartbeat = now
+                await self.heartbeat()
+
+    async def heartbeat(self):
+        try:
+            alive = await asyncio.to_thread(self.beat)
+            if not alive:
+                # Another worker already handed our leases back
+                logger.error(
+                    "Ledger worker %d was presumed dead, dropping its leases",
+                    self.worker_id,
+                )
+                for entry in self.entries.values():
+                    entry.leased = 0
+                self.worker_id = await asyncio.to_thread(self.register)
+            await asyncio.to_thread(self.recover)
+        except Exception:
+            logger.exception("Ledger heartbeat failed")
+
+    async def flush(self):
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+
+        try:
+            available = await asyncio.to_thread(self.commit_batch, batch)
+        except Exception:
+            logger.exception("Failed to commit %d ledger reservations", len(batch))
+            for product_id, quantity, _, future in batch:
+                self.entries[product_id].leased += quantity
+                if not future.done():
+                    future.set_exception(
+                        HTTPException(
+                            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Reservation could not be recorded",
+                        )
+                    )
+            return
+
+        for product_id, _, _, future in batch:
+            if not future.done():
+                future.set_result(available[product_id])
+
+    async def return_lease(self, product_id: int):
+        entry = self.entries[product_id]
+        async with entry.lock:
+            units, entry.leased = entry.leased, 0
+            if not units:
+                return
+            try:
+                await asyncio.to_thread(self.give_back, product_id, units)
+            except Exception:
+                logger.exception("Failed to return lease for product %d", product_id)
+                entry.leased += units
+
+    def register(self) -> int:
+        db = SessionLocal()
+        try:
+            worker = LedgerWorker(name=f"{socket.gethostname()}:{os.getpid()}")
+            db.add(worker)
+            db.commit()
+            logger.info("Registered ledger worker %d (%s)", worker.id, worker.name)
+            return worker.id
+        finally:
+            db.close()
+
+    def beat(self) -> bool:
+        """Refresh this worker's heartbeat; False if its row was reclaimed"""
+        db = SessionLocal()
+        try:
+            result = db.execute(
+                update(LedgerWorker)
+                .where(LedgerWorker.id == self.worker_id)
+                .values(heartbeat_at=datetime.utcnow())
+            )
+            db.commit()
+            return result.rowcount == 1
+        finally:
+            db.close()
+
+    def unregister(self):
+        """Drop this worker's rows unless a lease could not be returned"""
+        db = SessionLocal()
+        try:
+            held = (
+                db.query(LedgerLease)
+                .filter(LedgerLease.worker_id == self.worker_id, LedgerLease.units != 0)
+                .count()
+            )
+            if held:
+                return  # Left for recovery once the heartbeat expires
+            db.query(LedgerLease).filter(
+                LedgerLease.worker_id == self.worker_id
+            ).delete()
+            db.query(LedgerWorker).filter(LedgerWorker.id == self.worker_id).delete()
+            db.commit()
+        finally:
+            db.close()
+
+    def owns_leases(self, db: Session) -> bool:
+        """Lock this worker's row so recovery cannot hand back its leases meanwhile"""
+        return (
+            db.query(LedgerWorker)
+            .filter(LedgerWorker.id == self.worker_id)
+            .with_for_update()
+            .first()
+            is not None
+        )
+
+    def adjust_lease(self, db: Session, product_id: int, units: int):
+        lease = db.get(LedgerLease, (self.worker_id, product_id))
+        if lease is None:
+            lease = LedgerLease(
+                worker_id=self.worker_id, product_id=product_id, units=0
+            )
+            db.add(lease)
+        lease.units += units
+
+    def take_lease(self, product_id: int, want: int) -> int:
+        db = SessionLocal()
+        try:
+            if not self.owns_leases(db):
+                return 0
+            inventory = (
+                db.query(Inventory)
+                .filter(Inventory.product_id == product_id)
+                .with_for_update()
+                .first()
+            )
+            taken = min(want, inventory.available_quantity) if inventory else 0
+            if taken <= 0:
+                return 0
+            inventory.available_quantity -= taken
+            inventory.updated_at = datetime.utcnow()
+            self.adjust_lease(db, product_id, taken)
+            create_transaction(db, product_id, "lease", taken, commit=False)
+            db.commit()
+            return taken
+        finally:
+            db.close()
+
+    def give_back(self, product_id: int, units: int):
+        db = SessionLocal()
+        try:
+            if not self.owns_leases(db):
+                return  # Already handed back by recovery
+            update_stock(db, product_id, available=units)
+            self.adjust_lease(db, product_id, -units)
+            create_transaction(db, product_id, "lease", -units, commit=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def commit_batch(
+        self, batch: List[Tuple[int, int, Optional[int], asyncio.Future]]
+    ) -> Dict[int, int]:
+        """Record a batch; returns each product's stock across all workers"""
+        totals: Dict[int, int] = {}
+        for product_id, quantity, _, _ in batch:
+            totals[product_id] = totals.get(product_id, 0) + quantity
+
+        rows = [
+            {
+                "product_id": product_id,
+                "transaction_type": "reserve",
+                "quantity": quantity,
+                "reference_id": order_id,
+            }
+            for product_id, quantity, order_id, _ in batch
+        ]
+        rows += [
+            {
+                "product_id": product_id,
+                "transaction_type": "lease",
+                "quantity": -quantity,
+                "reference_id": None,
+            }
+            for product_id, quantity in totals.items()
+        ]
+
+        db = SessionLocal()
+        try:
+            if not self.owns_leases(db):
+                raise RuntimeError(f"Ledger worker {self.worker_id} lost its leases")
+            available: Dict[int, int] = {}
+            for product_id, quantity in totals.items():
+                stock = update_stock(db, product_id, reserved=quantity)
+                self.adjust_lease(db, product_id, -quantity)
+                available[product_id] = stock.available_quantity
+            db.flush()
+            for product_id, units in leased_units(db, totals).items():
+                available[product_id] += units
+            db.execute(insert(InventoryTransaction), rows)
+            db.commit()
+            return available
+        finally:
+            db.close()
+
+    def recover(self):
+        """Hand back the leases of workers whose heartbeat expired"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.worker_ttl)
+        db = SessionLocal()
+        try:
+            # Skip rows another worker is recovering or a live worker holds
+            expired = (
+                db.query(LedgerWorker)
+                .filter(
+                    LedgerWorker.heartbeat_at < cutoff,
+                    LedgerWorker.id != self.worker_id,
+                )
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            for worker in expired:
+                leases = (
+                    db.query(LedgerLease)
+                    .filter(LedgerLease.worker_id == worker.id)
+                    .all()
+                )
+                for lease in leases:
+                    if lease.units:
+                        logger.warning(
+                            "Returning %d units of product %d leased by "
+                            "expired worker %d (%s)",
+                            lease.units,
+                            lease.product_id,
+                            worker.id,
+                            worker.name,
+                        )
+                        update_stock(db, lease.product_id, available=lease.units)
+                        create_transaction(
+                            db, lease.product_id, "lease", -lease.units, commit=False
+                        )
+                    db.delete(lease)
+                db.delete(worker)
+            db.commit()
+        finally:
+            db.close()
+
+
+ledger = ReservationLedger(
+    LEDGER_LEASE_SIZE,
+    LEDGER_FLUSH_INTERVAL,
+    LEDGER_LEASE_IDLE_SECONDS,
+    LEDGER_HEARTBEAT_INTERVAL,
+    LEDGER_WORKER_TTL,
+)
 
 
 # ===== ROUTES =====
@@ -179,6 +735,28 @@ async def create_inventory(
     return response
 
 
+@app.post("/inventory/batch", response_model=List[InventoryLevel])
+async def get_inventory_batch(
+    batch_data: InventoryBatchRequest, db: Session = Depends(get_db)
+):
+    """Get stock levels for many products in one query - internal service call"""
+    inventories = (
+        db.query(Inventory)
+        .filter(Inventory.product_id.in_(set(batch_data.product_ids)))
+        .all()
+    )
+
+    leased = leased_units(db, batch_data.product_ids)
+    return [
+        InventoryLevel(
+            product_id=inv.product_id,
+            available_quantity=inv.available_quantity + leased.get(inv.product_id, 0),
+            reserved_quantity=inv.reserved_quantity,
+        )
+        for inv in inventories
+    ]
+
+
 @app.get("/inventory/{product_id}", response_model=InventoryResponse)
 async def get_inventory(product_id: int, db: Session = Depends(get_db)):
     """Get inventory for a product"""
@@ -190,12 +768,20 @@ async def get_inventory(product_id: int, db: Session = Depends(get_db)):
             detail="Inventory not found for this product",
         )
 
-    # Calculate derived fields
-    response = InventoryResponse.from_orm(inventory)
-    response.total_quantity = inventory.available_quantity + inventory.reserved_quantity
-    response.needs_reorder = inventory.available_quantity <= inventory.reorder_level
-
-    return response
+    # Calculate derived fields, counting stock leased to ledger workers
+    available = inventory.available_quantity + leased_units(db, [product_id]).get(
+        product_id, 0
+    )
+    return InventoryResponse(
+        id=inventory.id,
+        product_id=inventory.product_id,
+        available_quantity=available,
+        reserved_quantity=inventory.reserved_quantity,
+        reorder_level=inventory.reorder_level,
+        total_quantity=available + inventory.reserved_quantity,
+        needs_reorder=available <= inventory.reorder_level,
+        updated_at=inventory.updated_at,
+    )
 
 
 @app.post("/inventory/reserve", status_code=status.HTTP_200_OK)
@@ -203,50 +789,248 @@ async def reserve_inventory(
     reserve_data: ReserveRequest, db: Session = Depends(get_db)
 ):
     """Reserve inventory for an order"""
-    inventory = (
-        db.query(Inventory)
-        .filter(Inventory.product_id == reserve_data.product_id)
-        .first()
+    quantity = reserve_data.quantity
+    if reserve_data.product_id in HOT_SKUS:
+        available = await ledger.reserve(
+            reserve_data.product_id, quantity, reserve_data.order_id
+        )
+        if available is not None:
+            return {
+                "message": "Inventory reserved successfully",
+                "product_id": reserve_data.product_id,
+                "quantity_reserved": quantity,
+                "available_quantity": available,
+            }
+        # What is left of the lease goes back so the row can cover the request
+        await ledger.return_lease(reserve_data.product_id)
+
+    # Not a hot SKU, or the worker's lease ran dry: reserve against the row
+    updated = update_stock(
+        db,
+        reserve_data.product_id,
+        Inventory.available_quantity >= quantity,
+        available=-quantity,
+        reserved=quantity,
     )
 
-    if not inventory:
-        # Auto-create inventory if it doesn't exist
-        inventory = Inventory(
-            product_id=reserve_data.product_id,
-            available_quantity=0,
-            reserved_quantity=0,
+    if updated is None:
+        db.rollback()
+        inventory = (
+            db.query(Inventory)
+            .filter(Inventory.product_id == reserve_data.product_id)
+            .first()
         )
-        db.add(inventory)
-        db.commit()
-        db.refresh(inventory)
 
-    # Check availability
-    if inventory.available_quantity < reserve_data.quantity:
+        if inventory:
+            available = inventory.available_quantity + leased_units(
+                db, [reserve_data.product_id]
+            ).get(reserve_data.product_id, 0)
+            db.rollback()  # Hand the connection back before responding
+        else:
+            # Auto-create inventory if it doesn't exist
+            available = 0
+            db.add(
+                Inventory(
+                    product_id=reserve_data.product_id,
+                    available_quantity=0,
+                    reserved_quantity=0,
+                )
+            )
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()  # Created concurrently by another request
+
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Insufficient inventory. Available: {inventory.available_quantity}",
+            detail=f"Insufficient inventory. Available: {available}",
         )
 
-    # Reserve inventory
-    inventory.available_quantity -= reserve_data.quantity
-    inventory.reserved_quantity += reserve_data.quantity
-    inventory.updated_at = datetime.utcnow()
-    db.commit()
-
-    # Create transaction
+    # Create transaction in the same commit as the reservation
     create_transaction(
         db,
         reserve_data.product_id,
         "reserve",
-        reserve_data.quantity,
+        quantity,
         reserve_data.order_id,
+        commit=False,
     )
+    db.commit()
+
+    leased = leased_units(db, [reserve_data.product_id])
+    db.rollback()  # Hand the connection back before responding
 
     return {
         "message": "Inventory reserved successfully",
         "product_id": reserve_data.product_id,
-        "quantity_reserved": reserve_data.quantity,
-        "available_quantity": inventory.available_quantity,
+        "quantity_reserved": quantity,
+        "available_quantity": updated.available_quantity
+        + leased.get(reserve_data.product_id, 0),
+    }
+
+
+@app.post("/inventory/reserve/bulk", status_code=status.HTTP_200_OK)
+async def reserve_inventory_bulk(
+    reserve_data: BulkReserveRequest, db: Session = Depends(get_db)
+):
+    """
+    Reserve inventory for every line of an order, all-or-nothing
+
+    Rows are locked in product_id order so concurrent bulk reservations
+    cannot deadlock, and everything is written in a single commit. Retrying
+    a request for an order that already holds a reservation is a no-op.
+    Hot SKUs are reserved against the row too, after this worker hands its
+    lease back; stock other workers hold in leases is only reported.
+    """
+    # Total quantity per product, the same product may appear on several lines
+    quantities = {}
+    for item in reserve_data.items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+
+    for product_id in quantities:
+        if product_id in ledger.entries:
+            await ledger.return_lease(product_id)
+
+    inventories = {
+        inv.product_id: inv
+        for inv in db.query(Inventory)
+        .filter(Inventory.product_id.in_(quantities))
+        .order_by(Inventory.product_id)
+        .with_for_update()
+        .all()
+    }
+
+    # Checked under the row locks, so a concurrent retry sees the first commit
+    if reserve_data.order_id is not None and (
+        db.query(InventoryTransaction.id)
+        .filter(
+            InventoryTransaction.reference_id == reserve_data.order_id,
+            InventoryTransaction.transaction_type == "reserve",
+        )
+        .first()
+    ):
+        db.rollback()
+        return {
+            "message": "Inventory already reserved",
+            "order_id": reserve_data.order_id,
+            "items": [],
+        }
+
+    # Check availability of every line before changing anything
+    leased = leased_units(db, quantities)
+    shortages = [
+        {
+            "product_id": product_id,
+            "requested": quantity,
+            "available": (
+                inventories[product_id].available_quantity
+                if product_id in inventories
+                else 0
+            )
+            + leased.get(product_id, 0),
+        }
+        for product_id, quantity in sorted(quantities.items())
+        if product_id not in inventories
+        or inventories[product_id].available_quantity < quantity
+    ]
+    if shortages:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"message": "Insufficient inventory", "shortages": shortages},
+        )
+
+    # Reserve inventory
+    now = datetime.utcnow()
+    for product_id, quantity in quantities.items():
+        inventory = inventories[product_id]
+        inventory.available_quantity -= quantity
+        inventory.reserved_quantity += quantity
+        inventory.updated_at = now
+
+    # Create transactions
+    db.execute(
+        insert(InventoryTransaction),
+        [
+            {
+                "product_id": product_id,
+                "transaction_type": "reserve",
+                "quantity": quantity,
+                "reference_id": reserve_data.order_id,
+                "created_at": now,
+            }
+            for product_id, quantity in quantities.items()
+        ],
+    )
+    db.commit()
+
+    return {
+        "message": "Inventory reserved successfully",
+        "order_id": reserve_data.order_id,
+        "items": [
+            {
+                "product_id": product_id,
+                "quantity_reserved": quantity,
+                "available_quantity": inventories[product_id].available_quantity
+                + leased.get(product_id, 0),
+            }
+            for product_id, quantity in quantities.items()
+        ],
+    }
+
+
+@app.post("/inventory/release/bulk")
+async def release_inventory_bulk(
+    release_data: BulkReleaseRequest, db: Session = Depends(get_db)
+):
+    """
+    Release everything still reserved for an order
+
+    Quantities come from the order's own reserve/release/sold transactions,
+    so repeating the call, or calling it for an order whose reservation
+    never happened, releases nothing. Fails with 409, releasing nothing,
+    when a product no longer has that much reserved.
+    """
+    quantities = order_reservations(db, release_data.order_id)
+    if quantities:
+        # Lock the rows, then re-read so a concurrent release cannot double up
+        db.query(Inventory.id).filter(Inventory.product_id.in_(quantities)).order_by(
+            Inventory.product_id
+        ).with_for_update().all()
+        quantities = order_reservations(db, release_data.order_id)
+
+    failed = []
+    for product_id, quantity in sorted(quantities.items()):
+        updated = update_stock(
+            db,
+            product_id,
+            Inventory.reserved_quantity >= quantity,
+            available=quantity,
+            reserved=-quantity,
+        )
+        if updated is None:
+            failed.append({"product_id": product_id, "requested": quantity})
+            continue
+        create_transaction(
+            db, product_id, "release", quantity, release_data.order_id, commit=False
+        )
+
+    # Nothing is journaled unless every line could actually be released
+    if failed:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"message": "Reserved quantity is too low", "items": failed},
+        )
+    db.commit()
+
+    return {
+        "message": "Inventory released successfully",
+        "order_id": release_data.order_id,
+        "items": [
+            {"product_id": product_id, "quantity_released": quantity}
+            for product_id, quantity in quantities.items()
+        ],
     }
 
 
@@ -255,37 +1039,42 @@ async def release_inventory(
     reserve_data: ReserveRequest, db: Session = Depends(get_db)
 ):
     """Release reserved inventory (e.g., order cancelled)"""
-    inventory = (
-        db.query(Inventory)
-        .filter(Inventory.product_id == reserve_data.product_id)
-        .first()
+    quantity = reserve_data.quantity
+    updated = update_stock(
+        db,
+        reserve_data.product_id,
+        Inventory.reserved_quantity >= quantity,
+        available=quantity,
+        reserved=-quantity,
     )
 
-    if not inventory:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Inventory not found"
+    if updated is None:
+        db.rollback()
+        exists = (
+            db.query(Inventory.id)
+            .filter(Inventory.product_id == reserve_data.product_id)
+            .first()
         )
-
-    # Release inventory
-    if inventory.reserved_quantity < reserve_data.quantity:
+        db.rollback()
+        if not exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Inventory not found"
+            )
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Cannot release more than reserved quantity",
         )
 
-    inventory.reserved_quantity -= reserve_data.quantity
-    inventory.available_quantity += reserve_data.quantity
-    inventory.updated_at = datetime.utcnow()
-    db.commit()
-
     # Create transaction
     create_transaction(
         db,
         reserve_data.product_id,
         "release",
-        reserve_data.quantity,
+        quantity,
         reserve_data.order_id,
+        commit=False,
     )
+    db.commit()
 
     return {"message": "Inventory released successfully"}
 
@@ -293,36 +1082,41 @@ async def release_inventory(
 @app.post("/inventory/sold")
 async def mark_as_sold(reserve_data: ReserveRequest, db: Session = Depends(get_db)):
     """Mark reserved inventory as sold"""
-    inventory = (
-        db.query(Inventory)
-        .filter(Inventory.product_id == reserve_data.product_id)
-        .first()
+    quantity = reserve_data.quantity
+    updated = update_stock(
+        db,
+        reserve_data.product_id,
+        Inventory.reserved_quantity >= quantity,
+        reserved=-quantity,
     )
 
-    if not inventory:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Inventory not found"
+    if updated is None:
+        db.rollback()
+        exists = (
+            db.query(Inventory.id)
+            .filter(Inventory.product_id == reserve_data.product_id)
+            .first()
         )
-
-    # Mark as sold
-    if inventory.reserved_quantity < reserve_data.quantity:
+        db.rollback()
+        if not exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Inventory not found"
+            )
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Cannot sell more than reserved quantity",
         )
 
-    inventory.reserved_quantity -= reserve_data.quantity
-    inventory.updated_at = datetime.utcnow()
-    db.commit()
-
     # Create transaction
     create_transaction(
         db,
         reserve_data.product_id,
         "sold",
-        reserve_data.quantity,
+        quantity,
         reserve_data.order_id,
+        commit=False,
     )
+    db.commit()
 
     return {"message": "Inventory marked as sold"}
 
@@ -360,7 +1154,8 @@ async def restock_inventory(
         "message": "Inventory restocked successfully",
         "product_id": restock_data.product_id,
         "quantity_added": restock_data.quantity,
-        "new_quantity": inventory.available_quantity,
+        "new_quantity": inventory.available_quantity
+        + leased_units(db, [restock_data.product_id]).get(restock_data.product_id, 0),
     }
 
 
@@ -402,6 +1197,49 @@ async def get_inventory_transactions(
     return [TransactionResponse.from_orm(t) for t in transactions]
 
 
+@app.get("/inventory/transactions/{product_id}/feed", response_model=TransactionPage)
+async def get_inventory_transaction_feed(
+    product_id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+):
+    """
+    Get transaction history for a product, newest first
+
+    Pages with an opaque cursor: pass the previous page's next_cursor to get
+    the following page.
+    """
+    query = db.query(InventoryTransaction).filter(
+        InventoryTransaction.product_id == product_id
+    )
+
+    if cursor:
+        query = query.filter(
+            tuple_(InventoryTransaction.created_at, InventoryTransaction.id)
+            < decode_cursor(cursor)
+        )
+
+    # Fetch one extra row to know whether there is a next page
+    transactions = (
+        query.order_by(
+            InventoryTransaction.created_at.desc(), InventoryTransaction.id.desc()
+        )
+        .limit(limit + 1)
+        .all()
+    )
+
+    next_cursor = None
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        next_cursor = encode_cursor(transactions[-1].created_at, transactions[-1].id)
+
+    return TransactionPage(
+        items=[TransactionResponse.from_orm(t) for t in transactions],
+        next_cursor=next_cursor,
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -1,22 +1,41 @@
-from fastapi import FastAPI, HTTPException, Depends, Header, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Response, status
+from contextlib import asynccontextmanager
 from sqlalchemy import (
     create_engine,
+    tuple_,
+    update,
     Column,
     Integer,
     String,
     DateTime,
     Float,
+    Text,
     ForeignKey,
     Enum,
+    Index,
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session, relationship
 from pydantic import BaseModel
-from datetime import datetime
-from typing import Optional, List
-import httpx
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Tuple
+from common.idempotency import (
+    IdempotencyKeyMixin,
+    IdempotencyStore,
+    request_fingerprint,
+)
+from common.outbox import OutboxEventMixin, OutboxRelay
+from common.service_client import (
+    RequestContextMiddleware,
+    ServiceCallError,
+    ServiceClients,
+    deadline,
+    service_call_error_handler,
+)
 import asyncio
+import base64
 import json
+import logging
 import os
 import enum
 
@@ -38,10 +57,51 @@ NOTIFICATION_SERVICE_URL = os.getenv(
     "NOTIFICATION_SERVICE_URL", "http://notification-service:8005"
 )
 
+# Saga orchestration of order workflows across inventory and payment
+SAGA_STEP_TIMEOUT = float(os.getenv("SAGA_STEP_TIMEOUT", "10.0"))
+SAGA_STEP_RETRIES = int(os.getenv("SAGA_STEP_RETRIES", "2"))
+SAGA_RETRY_BACKOFF = float(os.getenv("SAGA_RETRY_BACKOFF", "0.5"))
+SAGA_RECOVERY_INTERVAL = float(os.getenv("SAGA_RECOVERY_INTERVAL", "30.0"))
+# A running saga not updated for this long is considered abandoned
+SAGA_STALE_SECONDS = float(os.getenv("SAGA_STALE_SECONDS", "60.0"))
+
+logger = logging.getLogger(__name__)
+
+# Pooled clients for the services orders call, opened in the lifespan hook
+service_clients = ServiceClients(
+    {
+        "product": PRODUCT_SERVICE_URL,
+        "payment": PAYMENT_SERVICE_URL,
+        "inventory": INVENTORY_SERVICE_URL,
+        "notification": NOTIFICATION_SERVICE_URL,
+    }
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await service_clients.start()
+    await outbox_relay.start()
+    await saga_orchestrator.start()
+    try:
+        yield
+    finally:
+        await saga_orchestrator.stop()
+        await outbox_relay.stop()
+        await service_clients.stop()
+
+
 app = FastAPI(
-    title="Order Service", description="Order management microservice", version="1.0.0"
+    title="Order Service",
+    description="Order management microservice",
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
+# Calls to other services share the deadline of the request being handled
+app.add_middleware(RequestContextMiddleware)
+app.add_exception_handler(ServiceCallError, service_call_error_handler)
+
 
 # ===== ENUMS =====
 class OrderStatus(str, enum.Enum):
@@ -53,6 +113,13 @@ class OrderStatus(str, enum.Enum):
     CANCELLED = "cancelled"
 
 
+class SagaStatus(str, enum.Enum):
+    RUNNING = "running"
+    COMPENSATING = "compensating"
+    COMPLETED = "completed"
+    COMPENSATED = "compensated"
+
+
 # ===== DATABASE MODELS =====
 class Order(Base):
     __tablename__ = "orders"
@@ -69,6 +136,11 @@ class Order(Base):
         "OrderItem", back_populates="order", cascade="all, delete-orphan"
     )
 
+    # Keyset pagination index for a user's orders, newest first
+    __table_args__ = (
+        Index("ix_orders_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
 
 class OrderItem(Base):
     __tablename__ = "order_items"
@@ -82,6 +154,31 @@ class OrderItem(Base):
     order = relationship("Order", back_populates="items")
 
 
+class OutboxEvent(OutboxEventMixin, Base):
+    __tablename__ = "outbox_events"
+
+
+class Saga(Base):
+    __tablename__ = "sagas"
+
+    id = Column(Integer, primary_key=True, index=True)
+    saga_type = Column(String, nullable=False)  # create_order, cancel_order
+    order_id = Column(Integer, nullable=False, index=True)
+    status = Column(String, default=SagaStatus.RUNNING.value)
+    context = Column(Text, nullable=False)  # JSON input shared by the steps
+    steps = Column(Text, nullable=False, default="{}")  # JSON step name -> state
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Recovery scans unfinished sagas by age
+    __table_args__ = (Index("ix_sagas_status_updated_at", "status", "updated_at"),)
+
+
+class IdempotencyKey(IdempotencyKeyMixin, Base):
+    __tablename__ = "idempotency_keys"
+
+
 # Create tables
 Base.metadata.create_all(bind=engine)
 
@@ -120,6 +217,16 @@ class OrderResponse(BaseModel):
         from_attributes = True
 
 
+class OrderPage(BaseModel):
+    items: List[OrderResponse]
+    next_cursor: Optional[str] = None
+
+
+class OrderPaymentUpdate(BaseModel):
+    payment_id: int
+    status: str
+
+
 # ===== DEPENDENCIES =====
 def get_db():
     db = SessionLocal()
@@ -140,111 +247,458 @@ def get_current_user_id(x_user_id: Optional[str] = Header(None)) -> int:
 
 
 # ===== UTILITY FUNCTIONS =====
-async def get_product_price(product_id: int) -> float:
-    """Call Product Service to get product price"""
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(f"{PRODUCT_SERVICE_URL}/products/{product_id}")
-            if response.status_code == 200:
-                product = response.json()
-                return product["price"]
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"Product {product_id} not found",
-                )
-        except httpx.RequestError:
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail="Product service unavailable",
-            )
+def encode_cursor(created_at: datetime, id: int) -> str:
+    """Opaque cursor pointing just after the row with (created_at, id)"""
+    raw = json.dumps([created_at.isoformat(), id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
 
-async def check_inventory(product_id: int, quantity: int) -> bool:
-    """Call Inventory Service to check stock availability"""
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(
-                f"{INVENTORY_SERVICE_URL}/inventory/{product_id}"
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(id)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+
+
+async def get_product_prices(product_ids: List[int]) -> Dict[int, float]:
+    """Call Product Service to get the prices of many products at once"""
+    products, missing = await service_clients.get_products(product_ids)
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Product {missing[0]} not found",
+        )
+    return {product_id: product.price for product_id, product in products.items()}
+
+
+async def check_inventory(quantities: Dict[int, int]) -> List[int]:
+    """
+    Call Inventory Service to check stock of many products at once
+
+    Returns the IDs of products without enough available stock.
+    """
+    try:
+        levels = await service_clients.get_inventory(list(quantities))
+    except ServiceCallError as e:
+        if e.status_code is None:
+            # If inventory service is down, allow order; the saga's
+            # reservation step is authoritative and cancels it if needed
+            return []
+        return list(quantities)
+
+    return [
+        product_id
+        for product_id, quantity in quantities.items()
+        if product_id not in levels or levels[product_id].available_quantity < quantity
+    ]
+
+
+async def reserve_order_inventory(context: dict):
+    """Saga step: reserve every item of an order in one all-or-nothing call"""
+    response = await service_clients.post(
+        "inventory",
+        "/inventory/reserve/bulk",
+        json={"order_id": context["order_id"], "items": context["items"]},
+    )
+    if response.status_code == 400:
+        raise SagaStepRejected("Insufficient inventory")
+    response.raise_for_status()
+
+
+async def release_order_inventory(context: dict):
+    """Saga step: release whatever is still reserved for an order (idempotent)"""
+    response = await service_clients.post(
+        "inventory", "/inventory/release/bulk", json={"order_id": context["order_id"]}
+    )
+    response.raise_for_status()
+
+
+def read_order_payment_id(order_id: int) -> Optional[int]:
+    db = SessionLocal()
+    try:
+        return db.query(Order.payment_id).filter(Order.id == order_id).scalar()
+    finally:
+        db.close()
+
+
+async def refund_order_payment(context: dict):
+    """Saga step: refund the order's payment if it was completed (idempotent)"""
+    payment_id = await asyncio.to_thread(read_order_payment_id, context["order_id"])
+
+    headers = {"X-User-ID": str(context["user_id"])}
+    if payment_id:
+        path = f"/payments/{payment_id}"
+    else:
+        path = f"/payments/order/{context['order_id']}"
+    response = await service_clients.get("payment", path, headers=headers)
+    if response.status_code == 404:
+        return  # Never paid
+    response.raise_for_status()
+
+    payment = response.json()
+    if payment["status"] != "completed":
+        return  # Failed, or already refunded
+
+    response = await service_clients.post(
+        "payment",
+        f"/payments/{payment['id']}/refund",
+        json={"reason": "Order cancelled"},
+        headers=headers,
+    )
+    response.raise_for_status()
+
+
+def queue_order_notification(db: Session, user_id: int, order_id: int, status: str):
+    """Stage a notification about order status in the current transaction"""
+    outbox_relay.add(
+        db,
+        "notification",
+        {
+            "user_id": user_id,
+            "type": "order_update",
+            "message": f"Order #{order_id} is now {status}",
+            "data": {"order_id": order_id, "status": status},
+        },
+    )
+
+
+# ===== EVENT OUTBOX =====
+outbox_relay = OutboxRelay(SessionLocal, OutboxEvent, service_clients)
+
+
+# ===== SAGA ORCHESTRATOR =====
+class SagaStepRejected(Exception):
+    """A step failed for a business reason, retrying it will not help"""
+
+
+class SagaStep:
+    def __init__(self, name: str, action, compensation=None, requires=()):
+        self.name = name
+        self.action = action  # async (context) -> None, raises on failure
+        self.compensation = compensation
+        self.requires = tuple(requires)  # Steps that must be done first
+
+
+class SagaDefinition:
+    def __init__(self, steps: List[SagaStep], on_completed=None, on_failed=None):
+        self.steps = steps
+        # Hooks run as (db, saga, context) in the commit that records the outcome
+        self.on_completed = on_completed
+        self.on_failed = on_failed
+
+
+class SagaOrchestrator:
+    """
+    Runs persisted sagas: forward steps, then compensations on failure
+
+    Step states are saved after every wave, so a saga interrupted by a crash
+    resumes where it stopped. Steps whose requirements are met run
+    concurrently, each under a timeout with retries. When a step with a
+    compensation fails, every attempted step is compensated in reverse order;
+    a timed-out step may still have taken effect, so compensations must be
+    idempotent. Steps without a compensation must eventually succeed: the
+    saga stays running and the recovery loop retries it. Saga rows are read
+    and written in worker threads with a short-lived session each, so no
+    connection is held while steps call other services.
+    """
+
+    DONE = "done"
+    FAILED = "failed"
+    COMPENSATED = "compensated"
+
+    def __init__(
+        self,
+        definitions: Dict[str, SagaDefinition],
+        step_timeout: float,
+        step_retries: int,
+        retry_backoff: float,
+        recovery_interval: float,
+        stale_seconds: float,
+    ):
+        self.definitions = definitions
+        self.step_timeout = step_timeout
+        self.step_retries = step_retries
+        self.retry_backoff = retry_backoff
+        self.recovery_interval = recovery_interval
+        self.stale_seconds = stale_seconds
+        self.task: Optional[asyncio.Task] = None
+        self.running: set = set()  # Sagas started with run_in_background
+
+    async def start(self):
+        self.task = asyncio.create_task(self.recover_forever())
+
+    async def stop(self):
+        # Interrupted sagas are resumed by recovery from their last saved wave
+        for task in [self.task, *self.running]:
+            task.cancel()
+        await asyncio.gather(self.task, *self.running, return_exceptions=True)
+
+    def begin(self, db: Session, saga_type: str, order_id: int, context: dict) -> Saga:
+        """Stage a new saga in the caller's transaction; run it after commit"""
+        saga = Saga(
+            saga_type=saga_type,
+            order_id=order_id,
+            status=SagaStatus.RUNNING.value,
+            context=json.dumps(context),
+            steps="{}",
+        )
+        db.add(saga)
+        return saga
+
+    def run_in_background(self, saga_id: int):
+        """Run a saga without waiting for it, keeping the task referenced"""
+        task = asyncio.create_task(self.run(saga_id))
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+
+    async def run(self, saga_id: int) -> Tuple[str, Optional[str]]:
+        """Drive a saga as far as it can go; returns its (status, error)"""
+        saga = await asyncio.to_thread(self.load, saga_id)
+        definition = self.definitions[saga.saga_type]
+        context = json.loads(saga.context)
+        states = json.loads(saga.steps)
+
+        if saga.status == SagaStatus.RUNNING.value:
+            await self.run_forward(saga, definition, context, states)
+        if saga.status == SagaStatus.COMPENSATING.value:
+            await self.run_compensations(saga, definition, context, states)
+        return saga.status, saga.error
+
+    async def run_forward(self, saga, definition, context, states):
+        while True:
+            ready = [
+                step
+                for step in definition.steps
+                if states.get(step.name) != self.DONE
+                and all(states.get(name) == self.DONE for name in step.requires)
+            ]
+            if not ready:
+                break
+
+            errors = await asyncio.gather(
+                *(self.attempt(step.action, context) for step in ready)
             )
-            if response.status_code == 200:
-                inventory = response.json()
-                return inventory["available_quantity"] >= quantity
-            return False
-        except httpx.RequestError:
-            # If inventory service is down, allow order (saga pattern would handle rollback)
-            return True
-
-
-async def reserve_inventory(product_id: int, quantity: int) -> bool:
-    """Reserve inventory items"""
-    async with httpx.AsyncClient() as client:
+            failed = []
+            for step, error in zip(ready, errors):
+                states[step.name] = self.FAILED if error else self.DONE
+                if error:
+                    failed.append(step)
+                    saga.error = f"{step.name}: {error}"
+
+            hook = None
+            if any(step.compensation for step in failed):
+                saga.status = SagaStatus.COMPENSATING.value
+                hook = definition.on_failed
+            await asyncio.to_thread(self.save, saga, states, hook, context)
+            if failed:
+                return
+
+        saga.status = SagaStatus.COMPLETED.value
+        saga.error = None
+        await asyncio.to_thread(
+            self.save, saga, states, definition.on_completed, context
+        )
+
+    async def run_compensations(self, saga, definition, context, states):
+        for step in reversed(definition.steps):
+            if not step.compensation or states.get(step.name) not in (
+                self.DONE,
+                self.FAILED,
+            ):
+                continue
+            error = await self.attempt(step.compensation, context)
+            if error:
+                saga.error = f"{step.name} compensation: {error}"
+                await asyncio.to_thread(self.save, saga, states)
+                return
+            states[step.name] = self.COMPENSATED
+            await asyncio.to_thread(self.save, saga, states)
+
+        saga.status = SagaStatus.COMPENSATED.value
+        await asyncio.to_thread(self.save, saga, states)
+
+    async def attempt(self, action, context: dict) -> Optional[str]:
+        """Run one step with timeout and retries; returns an error or None"""
+        error = None
+        for attempt in range(self.step_retries + 1):
+            try:
+                # Steps outlive the request that started the saga, their
+                # calls get the step timeout rather than the request's deadline
+                with deadline(self.step_timeout, detached=True):
+                    await asyncio.wait_for(action(context), self.step_timeout)
+                return None
+            except SagaStepRejected as e:
+                return str(e)
+            except asyncio.TimeoutError:
+                error = f"timed out after {self.step_timeout}s"
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+            if attempt < self.step_retries:
+                await asyncio.sleep(self.retry_backoff * 2**attempt)
+        return error
+
+    def load(self, saga_id: int) -> Saga:
+        """The saga's row, detached from its session"""
+        db = SessionLocal()
         try:
-            response = await client.post(
-                f"{INVENTORY_SERVICE_URL}/inventory/reserve",
-                json={"product_id": product_id, "quantity": quantity},
+            return db.query(Saga).filter(Saga.id == saga_id).one()
+        finally:
+            db.close()
+
+    def save(self, saga: Saga, states: dict, hook=None, context: dict = None):
+        """Persist a saga's progress, running an outcome hook in the same commit"""
+        saga.steps = json.dumps(states)
+        saga.updated_at = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(Saga)
+                .where(Saga.id == saga.id)
+                .values(
+                    status=saga.status,
+                    error=saga.error,
+                    steps=saga.steps,
+                    updated_at=saga.updated_at,
+                )
+            )
+            if hook:
+                hook(db, saga, context)
+            db.commit()
+        finally:
+            db.close()
+        outbox_relay.notify()  # Hooks may have staged notifications
+
+    async def recover(self):
+        """Resume sagas left unfinished by a crash or a failing service"""
+        claimed = await asyncio.to_thread(self.claim_stale)
+        if claimed:
+            logger.info(f"Resuming {len(claimed)} unfinished sagas")
+            await asyncio.gather(
+                *(self.run(saga_id) for saga_id in claimed), return_exceptions=True
             )
-            return response.status_code == 200
-        except httpx.RequestError:
-            return False
-
 
-async def send_order_notification(user_id: int, order_id: int, status: str):
-    """Send notification about order status"""
-    async with httpx.AsyncClient() as client:
+    def claim_stale(self) -> List[int]:
+        """Claim up to 100 sagas nobody has saved for stale_seconds"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_seconds)
+        db = SessionLocal()
         try:
-            await client.post(
-                f"{NOTIFICATION_SERVICE_URL}/notifications/send",
-                json={
-                    "user_id": user_id,
-                    "type": "order_update",
-                    "message": f"Order #{order_id} is now {status}",
-                    "data": {"order_id": order_id, "status": status},
-                },
+            stale = (
+                db.query(Saga.id, Saga.updated_at)
+                .filter(
+                    Saga.status.in_(
+                        [SagaStatus.RUNNING.value, SagaStatus.COMPENSATING.value]
+                    ),
+                    Saga.updated_at < cutoff,
+                )
+                .limit(100)
+                .all()
             )
-        except httpx.RequestError:
-            # Notification failure shouldn't block order creation
-            pass
+            claimed = []
+            for saga_id, updated_at in stale:
+                # Bump updated_at as a claim, so only one replica resumes it
+                result = db.execute(
+                    update(Saga)
+                    .where(Saga.id == saga_id, Saga.updated_at == updated_at)
+                    .values(updated_at=datetime.utcnow())
+                )
+                if result.rowcount:
+                    claimed.append(saga_id)
+            db.commit()
+            return claimed
+        finally:
+            db.close()
+
+    async def recover_forever(self):
+        while True:
+            try:
+                await self.recover()
+            except Exception:
+                logger.exception("Saga recovery failed")
+            await asyncio.sleep(self.recovery_interval)
 
 
-# ===== ROUTES =====
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy", "service": "order-service"}
+def order_placed(db: Session, saga: Saga, context: dict):
+    queue_order_notification(
+        db, context["user_id"], context["order_id"], OrderStatus.PENDING.value
+    )
 
 
-@app.post("/orders", response_model=OrderResponse, status_code=status.HTTP_201_CREATED)
-async def create_order(
-    order_data: OrderCreate,
-    user_id: int = Depends(get_current_user_id),
-    db: Session = Depends(get_db),
-):
-    """Create a new order"""
+def order_rejected(db: Session, saga: Saga, context: dict):
+    db.query(Order).filter(Order.id == context["order_id"]).update(
+        {"status": OrderStatus.CANCELLED.value, "updated_at": datetime.utcnow()}
+    )
+    queue_order_notification(
+        db, context["user_id"], context["order_id"], OrderStatus.CANCELLED.value
+    )
+
+
+saga_orchestrator = SagaOrchestrator(
+    {
+        "create_order": SagaDefinition(
+            [
+                SagaStep(
+                    "reserve_inventory",
+                    reserve_order_inventory,
+                    compensation=release_order_inventory,
+                ),
+            ],
+            on_completed=order_placed,
+            on_failed=order_rejected,
+        ),
+        # Independent steps, run concurrently and retried until they succeed
+        "cancel_order": SagaDefinition(
+            [
+                SagaStep("release_inventory", release_order_inventory),
+                SagaStep("refund_payment", refund_order_payment),
+            ]
+        ),
+    },
+    SAGA_STEP_TIMEOUT,
+    SAGA_STEP_RETRIES,
+    SAGA_RETRY_BACKOFF,
+    SAGA_RECOVERY_INTERVAL,
+    SAGA_STALE_SECONDS,
+)
 
+
+# ===== IDEMPOTENCY =====
+idempotency_store = IdempotencyStore(SessionLocal, IdempotencyKey)
+
+
+async def place_order(order_data: OrderCreate, user_id: int, db: Session):
+    """Store a new order and run the saga that reserves its stock"""
     if not order_data.items:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Order must contain at least one item",
         )
 
-    # Calculate total amount and check inventory
+    # Total quantity per product, the same product may appear on several lines
+    quantities: Dict[int, int] = {}
+    for item in order_data.items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+
+    # Get prices and check inventory for the whole cart in two concurrent calls
+    prices, out_of_stock = await asyncio.gather(
+        get_product_prices(list(quantities)), check_inventory(quantities)
+    )
+    if out_of_stock:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Product {out_of_stock[0]} is out of stock",
+        )
+
+    # Calculate total amount
     total_amount = 0.0
     order_items_data = []
 
     for item in order_data.items:
-        # Get product price
-        price = await get_product_price(item.product_id)
-
-        # Check inventory
-        has_stock = await check_inventory(item.product_id, item.quantity)
-        if not has_stock:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Product {item.product_id} is out of stock",
-            )
-
-        item_total = price * item.quantity
-        total_amount += item_total
+        price = prices[item.product_id]
+        total_amount += price * item.quantity
 
         order_items_data.append(
             {"product_id": item.product_id, "quantity": item.quantity, "price": price}
@@ -256,28 +710,77 @@ async def create_order(
     )
 
     db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
+    db.flush()
 
     # Create order items
-    for item_data in order_items_data:
-        db_item = OrderItem(order_id=db_order.id, **item_data)
-        db.add(db_item)
-
-        # Reserve inventory
-        await reserve_inventory(item_data["product_id"], item_data["quantity"])
+    db.add_all(
+        [OrderItem(order_id=db_order.id, **item_data) for item_data in order_items_data]
+    )
 
+    # The order, its items and the saga that reserves its stock commit together
+    saga = saga_orchestrator.begin(
+        db,
+        "create_order",
+        db_order.id,
+        {
+            "order_id": db_order.id,
+            "user_id": user_id,
+            "items": [
+                {"product_id": product_id, "quantity": quantity}
+                for product_id, quantity in quantities.items()
+            ],
+        },
+    )
     db.commit()
-    db.refresh(db_order)
 
-    # Send notification asynchronously
-    asyncio.create_task(
-        send_order_notification(user_id, db_order.id, OrderStatus.PENDING.value)
-    )
+    saga_status, error = await saga_orchestrator.run(saga.id)
+    if saga_status != SagaStatus.COMPLETED.value:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Order could not be placed: {error}",
+        )
 
+    db.refresh(db_order)
     return OrderResponse.from_orm(db_order)
 
 
+# ===== ROUTES =====
+@app.get("/health")
+async def health_check():
+    return {"status": "healthy", "service": "order-service"}
+
+
+@app.get("/metrics")
+async def order_metrics():
+    """Calls made to other services"""
+    return {"service_calls": service_clients.stats()}
+
+
+@app.post("/orders", response_model=OrderResponse, status_code=status.HTTP_201_CREATED)
+async def create_order(
+    order_data: OrderCreate,
+    response: Response,
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None),
+):
+    """
+    Create a new order
+
+    Retries sent with the same Idempotency-Key get the first response back.
+    """
+    if not idempotency_key:
+        return await place_order(order_data, user_id, db)
+
+    return await idempotency_store.run(
+        f"{user_id}:{idempotency_key}",
+        request_fingerprint(order_data),
+        response,
+        status.HTTP_201_CREATED,
+        lambda: place_order(order_data, user_id, db),
+    )
+
+
 @app.get("/orders", response_model=List[OrderResponse])
 async def list_orders(
     user_id: int = Depends(get_current_user_id),
@@ -298,6 +801,40 @@ async def list_orders(
     return [OrderResponse.from_orm(order) for order in orders]
 
 
+@app.get("/orders/feed", response_model=OrderPage)
+async def get_order_feed(
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+):
+    """
+    List orders for current user, newest first
+
+    Pages with an opaque cursor: pass the previous page's next_cursor to get
+    the following page.
+    """
+    query = db.query(Order).filter(Order.user_id == user_id)
+
+    if cursor:
+        query = query.filter(tuple_(Order.created_at, Order.id) < decode_cursor(cursor))
+
+    # Fetch one extra row to know whether there is a next page
+    orders = (
+        query.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit + 1).all()
+    )
+
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor(orders[-1].created_at, orders[-1].id)
+
+    return OrderPage(
+        items=[OrderResponse.from_orm(order) for order in orders],
+        next_cursor=next_cursor,
+    )
+
+
 @app.get("/orders/{order_id}", response_model=OrderResponse)
 async def get_order(
     order_id: int,
@@ -336,10 +873,9 @@ async def update_order_status(
 
     order.status = status.value
     order.updated_at = datetime.utcnow()
+    queue_order_notification(db, user_id, order_id, status.value)
     db.commit()
-
-    # Send notification
-    asyncio.create_task(send_order_notification(user_id, order_id, status.value))
+    outbox_relay.notify()
 
     return {"message": "Order status updated", "status": status.value}
 
@@ -368,22 +904,56 @@ async def cancel_order(
 
     order.status = OrderStatus.CANCELLED.value
     order.updated_at = datetime.utcnow()
-    db.commit()
 
-    # Release inventory (compensation in saga pattern)
-    for item in order.items:
-        async with httpx.AsyncClient() as client:
-            try:
-                await client.post(
-                    f"{INVENTORY_SERVICE_URL}/inventory/release",
-                    json={"product_id": item.product_id, "quantity": item.quantity},
-                )
-            except httpx.RequestError:
-                pass
+    # Release stock and refund payment; unfinished steps are retried by recovery
+    saga = saga_orchestrator.begin(
+        db, "cancel_order", order.id, {"order_id": order.id, "user_id": user_id}
+    )
+    db.commit()
+    await saga_orchestrator.run(saga.id)
 
     return {"message": "Order cancelled successfully"}
 
 
+@app.patch("/orders/{order_id}/payment")
+async def update_order_payment(
+    order_id: int, payment_data: OrderPaymentUpdate, db: Session = Depends(get_db)
+):
+    """Record the payment of an order (called by Payment Service)"""
+    order = db.query(Order).filter(Order.id == order_id).first()
+
+    if not order:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Order not found"
+        )
+
+    order.payment_id = payment_data.payment_id
+    order.updated_at = datetime.utcnow()
+
+    saga = None
+    if payment_data.status == OrderStatus.CONFIRMED.value:
+        if order.status == OrderStatus.PENDING.value:
+            order.status = OrderStatus.CONFIRMED.value
+            queue_order_notification(
+                db, order.user_id, order.id, OrderStatus.CONFIRMED.value
+            )
+        elif order.status == OrderStatus.CANCELLED.value:
+            # Paid after it was cancelled: refund it
+            saga = saga_orchestrator.begin(
+                db,
+                "cancel_order",
+                order.id,
+                {"order_id": order.id, "user_id": order.user_id},
+            )
+    db.commit()
+    outbox_relay.notify()
+
+    if saga:
+        saga_orchestrator.run_in_background(saga.id)
+
+    return {"message": "Order payment updated", "status": order.status}
+
+
 if __name__ == "__main__":
     import uvicorn
 
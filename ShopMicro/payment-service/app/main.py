@@ -1,12 +1,38 @@
-from fastapi import FastAPI, HTTPException, Depends, Header, status
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float, Enum
+from fastapi import FastAPI, HTTPException, Depends, Header, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
+from sqlalchemy import (
+    create_engine,
+    update,
+    Column,
+    Integer,
+    String,
+    DateTime,
+    Float,
+    Enum,
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from pydantic import BaseModel
-from datetime import datetime
-from typing import Optional
-import httpx
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Set, Tuple
+from common.idempotency import (
+    IdempotencyKeyMixin,
+    IdempotencyStore,
+    request_fingerprint,
+)
+from common.outbox import OutboxEventMixin, OutboxRelay
+from common.service_client import (
+    RequestContextMiddleware,
+    ServiceCallError,
+    ServiceClients,
+    deadline,
+    service_call_error_handler,
+)
 import asyncio
+import json
+import logging
 import os
 import enum
 import uuid
@@ -25,12 +51,51 @@ NOTIFICATION_SERVICE_URL = os.getenv(
     "NOTIFICATION_SERVICE_URL", "http://notification-service:8005"
 )
 
+# Asynchronous payments, requested with "Prefer: respond-async"
+PAYMENT_WORKER_CONCURRENCY = int(os.getenv("PAYMENT_WORKER_CONCURRENCY", "10"))
+PAYMENT_BATCH_SIZE = int(os.getenv("PAYMENT_BATCH_SIZE", "25"))
+PAYMENT_BATCH_WINDOW = float(os.getenv("PAYMENT_BATCH_WINDOW", "0.05"))
+PAYMENT_QUEUE_SIZE = int(os.getenv("PAYMENT_QUEUE_SIZE", "10000"))
+# A pipeline batch left processing this long (its worker died before recording
+# the processor's answer) is flagged for reconciliation, never sent again
+PAYMENT_PROCESSING_TIMEOUT = float(os.getenv("PAYMENT_PROCESSING_TIMEOUT", "300.0"))
+PAYMENT_EVENTS_POLL_INTERVAL = float(os.getenv("PAYMENT_EVENTS_POLL_INTERVAL", "1.0"))
+PAYMENT_EVENTS_TIMEOUT = float(os.getenv("PAYMENT_EVENTS_TIMEOUT", "120.0"))
+PAYMENT_EVENTS_KEEPALIVE = float(os.getenv("PAYMENT_EVENTS_KEEPALIVE", "15.0"))
+
+logger = logging.getLogger(__name__)
+
+# Pooled clients for the services payments call, opened in the lifespan hook
+service_clients = ServiceClients(
+    {"order": ORDER_SERVICE_URL, "notification": NOTIFICATION_SERVICE_URL}
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await service_clients.start()
+    await outbox_relay.start()
+    await payment_pipeline.start()
+    try:
+        yield
+    finally:
+        await payment_pipeline.stop()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        await outbox_relay.stop()
+        await service_clients.stop()
+
+
 app = FastAPI(
     title="Payment Service",
     description="Payment processing microservice",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
+# Calls to other services share the deadline of the request being handled
+app.add_middleware(RequestContextMiddleware)
+app.add_exception_handler(ServiceCallError, service_call_error_handler)
+
 
 # ===== ENUMS =====
 class PaymentStatus(str, enum.Enum):
@@ -58,13 +123,23 @@ class Payment(Base):
     amount = Column(Float, nullable=False)
     currency = Column(String, default="USD")
     payment_method = Column(String, nullable=False)
-    status = Column(String, default=PaymentStatus.PENDING.value)
+    status = Column(String, default=PaymentStatus.PENDING.value, index=True)
     transaction_id = Column(String, unique=True, index=True)
     error_message = Column(String, nullable=True)
+    # Set while a pipeline batch holding the payment is at the processor
+    claimed_until = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+class OutboxEvent(OutboxEventMixin, Base):
+    __tablename__ = "outbox_events"
+
+
+class IdempotencyKey(IdempotencyKeyMixin, Base):
+    __tablename__ = "idempotency_keys"
+
+
 # Create tables
 Base.metadata.create_all(bind=engine)
 
@@ -130,6 +205,23 @@ async def process_payment_gateway(
     # Simulate processing delay
     await asyncio.sleep(1)
 
+    return simulate_gateway_decision()
+
+
+async def process_payment_gateway_batch(
+    payments: List[Tuple[float, str]],
+) -> List[Tuple[bool, str, Optional[str]]]:
+    """
+    Simulate a batch authorization: one round trip for many payments
+    In production, use the processor's batch API where it offers one
+    """
+    # Simulate processing delay, paid once per batch
+    await asyncio.sleep(1)
+
+    return [simulate_gateway_decision() for _ in payments]
+
+
+def simulate_gateway_decision() -> Tuple[bool, str, Optional[str]]:
     # Generate transaction ID
     transaction_id = f"TXN-{uuid.uuid4().hex[:12].upper()}"
 
@@ -144,57 +236,365 @@ async def process_payment_gateway(
         return False, transaction_id, "Payment declined by bank"
 
 
+# Fire-and-forget calls, referenced until they finish so they are not collected
+background_tasks: Set[asyncio.Task] = set()
+
+
+def run_in_background(coroutine):
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
 async def update_order_payment_status(order_id: int, payment_id: int, status: str):
     """Update order with payment information"""
-    async with httpx.AsyncClient() as client:
+    # Runs in the background, its budget does not end with the payment request
+    with deadline(service_clients.timeout, detached=True):
         try:
-            await client.patch(
-                f"{ORDER_SERVICE_URL}/orders/{order_id}/payment",
+            await service_clients.patch(
+                "order",
+                f"/orders/{order_id}/payment",
                 json={"payment_id": payment_id, "status": status},
             )
-        except httpx.RequestError:
+        except ServiceCallError:
             pass
 
 
-async def send_payment_notification(
-    user_id: int, payment_id: int, status: str, amount: float
+def queue_payment_notification(
+    db: Session, user_id: int, payment_id: int, status: str, amount: float
 ):
-    """Send notification about payment status"""
-    async with httpx.AsyncClient() as client:
+    """Stage a notification about payment status in the current transaction"""
+    outbox_relay.add(
+        db,
+        "notification",
+        {
+            "user_id": user_id,
+            "type": "payment_update",
+            "message": f"Payment of ${amount:.2f} is {status}",
+            "data": {"payment_id": payment_id, "status": status, "amount": amount},
+        },
+    )
+
+
+# ===== EVENT OUTBOX =====
+outbox_relay = OutboxRelay(SessionLocal, OutboxEvent, service_clients)
+
+
+def apply_gateway_result(
+    db: Session,
+    payment: Payment,
+    success: bool,
+    transaction_id: str,
+    error_msg: Optional[str],
+):
+    """Record the processor's answer and stage the payment notification"""
+    payment.status = (
+        PaymentStatus.COMPLETED.value if success else PaymentStatus.FAILED.value
+    )
+    payment.transaction_id = transaction_id
+    if not success:
+        payment.error_message = error_msg
+    payment.updated_at = datetime.utcnow()
+    queue_payment_notification(
+        db, payment.user_id, payment.id, payment.status, payment.amount
+    )
+
+
+class PaymentPipeline:
+    """
+    Background processing of payments accepted with 202
+
+    Accepted payments are queued by ID and sent to the processor in batches
+    of up to PAYMENT_BATCH_SIZE collected over PAYMENT_BATCH_WINDOW, with at
+    most PAYMENT_WORKER_CONCURRENCY processor calls in flight. The pending row
+    is committed before the 202 goes out, so payments still queued when the
+    process stops are picked up again on the next start. Database work runs
+    in worker threads with a short-lived session each, so no connection is
+    held while a batch is at the processor.
+
+    A batch is claimed before it is sent, so no payment ever goes to the
+    processor twice. A claim that outlives processing_timeout (its worker
+    died, or failed to record the answer) may already have been charged; it
+    is left processing and flagged for reconciliation rather than resent.
+    Status watchers (server-sent event streams) are woken as soon as a batch
+    settles.
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        batch_size: int,
+        batch_window: float,
+        processing_timeout: float,
+    ):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.processing_timeout = processing_timeout
+        self.queue: Optional[asyncio.Queue] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.task: Optional[asyncio.Task] = None
+        self.sweeper: Optional[asyncio.Task] = None
+        self.in_flight: set = set()
+        self.watchers: Dict[int, Set[asyncio.Event]] = {}
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+
+        await asyncio.to_thread(self.flag_stale)
+        for payment_id in await asyncio.to_thread(self.pending_ids):
+            self.queue.put_nowait(payment_id)
+
+        self.task = asyncio.create_task(self.run())
+        self.sweeper = asyncio.create_task(self.sweep())
+
+    async def stop(self):
+        for task in (self.task, self.sweeper):
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        # Let batches already at the processor record their results
+        await asyncio.gather(*self.in_flight, return_exceptions=True)
+
+    def backlog(self) -> int:
+        return self.queue.qsize() if self.queue else 0
+
+    def submit(self, payment_id: int):
+        self.queue.put_nowait(payment_id)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            flush_at = loop.time() + self.batch_window
+            while len(batch) < self.batch_size:
+                remaining = flush_at - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            await self.semaphore.acquire()
+            task = asyncio.create_task(self.process_batch(batch))
+            self.in_flight.add(task)
+            task.add_done_callback(self.batch_done)
+
+    def batch_done(self, task: asyncio.Task):
+        self.in_flight.discard(task)
+        self.semaphore.release()
+
+    async def sweep(self):
+        """Look for abandoned claims while running, not only on start"""
+        while True:
+            await asyncio.sleep(self.processing_timeout / 2)
+            try:
+                await asyncio.to_thread(self.flag_stale)
+            except Exception:
+                logger.exception("Failed to check for stale payment claims")
+
+    async def process_batch(self, payment_ids: List[int]):
+        try:
+            payments = await asyncio.to_thread(self.claim, payment_ids)
+            if not payments:
+                return
+
+            try:
+                results = await process_payment_gateway_batch(
+                    [(payment.amount, payment.payment_method) for payment in payments]
+                )
+            except Exception:
+                claimed = [payment.id for payment in payments]
+                logger.exception(f"Payment batch {claimed} failed, requeueing")
+                await asyncio.to_thread(self.release, claimed)
+                await asyncio.sleep(1)
+                for payment_id in claimed:
+                    self.submit(payment_id)
+                return
+
+            settled = await asyncio.to_thread(self.record, payments, results)
+            outbox_relay.notify()
+
+            for payment_id, order_id, payment_status in settled:
+                self.wake(payment_id)
+                if payment_status == PaymentStatus.COMPLETED.value:
+                    run_in_background(
+                        update_order_payment_status(order_id, payment_id, "confirmed")
+                    )
+        except Exception:
+            logger.exception(f"Failed to process payment batch {payment_ids}")
+
+    def pending_ids(self) -> List[int]:
+        db = SessionLocal()
+        try:
+            rows = (
+                db.query(Payment.id)
+                .filter(Payment.status == PaymentStatus.PENDING.value)
+                .order_by(Payment.id)
+                .all()
+            )
+            return [payment_id for (payment_id,) in rows]
+        finally:
+            db.close()
+
+    def claim(self, payment_ids: List[int]) -> List[Payment]:
+        """Move a batch's pending payments to processing; returns them detached"""
+        now = datetime.utcnow()
+        db = SessionLocal()
         try:
-            message = f"Payment of ${amount:.2f} is {status}"
-            await client.post(
-                f"{NOTIFICATION_SERVICE_URL}/notifications/send",
-                json={
-                    "user_id": user_id,
-                    "type": "payment_update",
-                    "message": message,
-                    "data": {
-                        "payment_id": payment_id,
-                        "status": status,
-                        "amount": amount,
-                    },
-                },
+            claimed = (
+                db.execute(
+                    update(Payment)
+                    .where(
+                        Payment.id.in_(payment_ids),
+                        Payment.status == PaymentStatus.PENDING.value,
+                    )
+                    .values(
+                        status=PaymentStatus.PROCESSING.value,
+                        claimed_until=now + timedelta(seconds=self.processing_timeout),
+                        updated_at=now,
+                    )
+                    .returning(Payment.id)
+                )
+                .scalars()
+                .all()
             )
-        except httpx.RequestError:
+            db.commit()
+            if not claimed:
+                return []
+            return (
+                db.query(Payment)
+                .filter(Payment.id.in_(claimed))
+                .order_by(Payment.id)
+                .all()
+            )
+        finally:
+            db.close()
+
+    def release(self, payment_ids: List[int]):
+        """Hand a batch the processor never took back to the queue"""
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(Payment)
+                .where(Payment.id.in_(payment_ids))
+                .values(
+                    status=PaymentStatus.PENDING.value,
+                    claimed_until=None,
+                    updated_at=datetime.utcnow(),
+                )
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def record(
+        self,
+        claimed: List[Payment],
+        results: List[Tuple[bool, str, Optional[str]]],
+    ) -> List[Tuple[int, int, str]]:
+        """Store the processor's answers; returns (id, order_id, status) of each"""
+        answers = {payment.id: result for payment, result in zip(claimed, results)}
+        db = SessionLocal()
+        try:
+            payments = (
+                db.query(Payment)
+                .filter(Payment.id.in_(answers))
+                .order_by(Payment.id)
+                .all()
+            )
+            settled = []
+            for payment in payments:
+                # The answer settles a claim even if it was already flagged
+                payment.claimed_until = None
+                payment.error_message = None
+                apply_gateway_result(db, payment, *answers[payment.id])
+                settled.append((payment.id, payment.order_id, payment.status))
+            db.commit()
+            return settled
+        finally:
+            db.close()
+
+    def flag_stale(self):
+        """Flag claims whose worker never recorded the processor's answer"""
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            stale = (
+                db.execute(
+                    update(Payment)
+                    .where(
+                        Payment.status == PaymentStatus.PROCESSING.value,
+                        Payment.claimed_until < now,
+                    )
+                    .values(
+                        claimed_until=None,
+                        error_message="Processor outcome unknown, "
+                        "reconcile before retrying",
+                        updated_at=now,
+                    )
+                    .returning(Payment.id)
+                )
+                .scalars()
+                .all()
+            )
+            db.commit()
+        finally:
+            db.close()
+        if stale:
+            logger.error(f"Payments {stale} need reconciliation with the processor")
+
+    async def wait_for_change(self, payment_id: int, timeout: float):
+        """Wait until a batch containing the payment settles, or the timeout"""
+        event = asyncio.Event()
+        self.watchers.setdefault(payment_id, set()).add(event)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
             pass
+        finally:
+            # Drop the entry with its last waiter, woken or not
+            waiting = self.watchers.get(payment_id)
+            if waiting is not None:
+                waiting.discard(event)
+                if not waiting:
+                    del self.watchers[payment_id]
+
+    def wake(self, payment_id: int):
+        for event in self.watchers.pop(payment_id, ()):
+            event.set()
+
+
+payment_pipeline = PaymentPipeline(
+    PAYMENT_WORKER_CONCURRENCY,
+    PAYMENT_BATCH_SIZE,
+    PAYMENT_BATCH_WINDOW,
+    PAYMENT_PROCESSING_TIMEOUT,
+)
 
 
-# ===== ROUTES =====
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy", "service": "payment-service"}
+# ===== IDEMPOTENCY =====
+idempotency_store = IdempotencyStore(SessionLocal, IdempotencyKey)
 
 
-@app.post(
-    "/payments", response_model=PaymentResponse, status_code=status.HTTP_201_CREATED
-)
-async def create_payment(
+async def place_payment(
     payment_data: PaymentCreate,
-    user_id: int = Depends(get_current_user_id),
-    db: Session = Depends(get_db),
+    user_id: int,
+    db: Session,
+    response: Response,
+    respond_async: bool,
 ):
-    """Process a new payment"""
+    """Store a new payment and process it, or queue it when respond_async"""
+    if respond_async and payment_pipeline.backlog() >= PAYMENT_QUEUE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Payment queue is full",
+            headers={"Retry-After": "1"},
+        )
 
     # Check if payment already exists for this order
     existing_payment = (
@@ -219,13 +619,27 @@ async def create_payment(
         amount=payment_data.amount,
         currency=payment_data.currency,
         payment_method=payment_data.payment_method.value,
-        status=PaymentStatus.PROCESSING.value,
+        status=(
+            PaymentStatus.PENDING.value
+            if respond_async
+            else PaymentStatus.PROCESSING.value
+        ),
         transaction_id=f"PENDING-{uuid.uuid4().hex[:8]}",
     )
 
     db.add(db_payment)
+    db.flush()
+    accepted = PaymentResponse.from_orm(db_payment)
+    # Committing without a refresh hands the connection back to the pool, so
+    # it is not held while the payment waits for the processor
     db.commit()
-    db.refresh(db_payment)
+
+    if respond_async:
+        payment_pipeline.submit(accepted.id)
+        response.status_code = status.HTTP_202_ACCEPTED
+        response.headers["Preference-Applied"] = "respond-async"
+        response.headers["Retry-After"] = "1"
+        return accepted
 
     # Process payment through gateway
     card_details = (
@@ -242,31 +656,18 @@ async def create_payment(
     )
 
     # Update payment record
-    if success:
-        db_payment.status = PaymentStatus.COMPLETED.value
-        db_payment.transaction_id = transaction_id
+    apply_gateway_result(db, db_payment, success, transaction_id, error_msg)
+    db.commit()
+    db.refresh(db_payment)
+    outbox_relay.notify()
 
+    if success:
         # Update order status
-        asyncio.create_task(
+        run_in_background(
             update_order_payment_status(
                 payment_data.order_id, db_payment.id, "confirmed"
             )
         )
-    else:
-        db_payment.status = PaymentStatus.FAILED.value
-        db_payment.transaction_id = transaction_id
-        db_payment.error_message = error_msg
-
-    db_payment.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(db_payment)
-
-    # Send notification
-    asyncio.create_task(
-        send_payment_notification(
-            user_id, db_payment.id, db_payment.status, db_payment.amount
-        )
-    )
 
     if not success:
         raise HTTPException(
@@ -277,6 +678,50 @@ async def create_payment(
     return PaymentResponse.from_orm(db_payment)
 
 
+# ===== ROUTES =====
+@app.get("/health")
+async def health_check():
+    return {"status": "healthy", "service": "payment-service"}
+
+
+@app.get("/metrics")
+async def payment_metrics():
+    """Calls made to other services"""
+    return {"service_calls": service_clients.stats()}
+
+
+@app.post(
+    "/payments", response_model=PaymentResponse, status_code=status.HTTP_201_CREATED
+)
+async def create_payment(
+    payment_data: PaymentCreate,
+    response: Response,
+    user_id: int = Depends(get_current_user_id),
+    db: Session = Depends(get_db),
+    prefer: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None),
+):
+    """
+    Process a new payment
+
+    With "Prefer: respond-async" the payment is accepted with 202 and
+    processed in the background; follow it with GET /payments/{id} or the
+    GET /payments/{id}/events stream. Retries sent with the same
+    Idempotency-Key get the first response back.
+    """
+    respond_async = "respond-async" in (prefer or "").lower()
+    if not idempotency_key:
+        return await place_payment(payment_data, user_id, db, response, respond_async)
+
+    return await idempotency_store.run(
+        f"{user_id}:{idempotency_key}",
+        request_fingerprint(payment_data),
+        response,
+        status.HTTP_201_CREATED,
+        lambda: place_payment(payment_data, user_id, db, response, respond_async),
+    )
+
+
 @app.get("/payments/{payment_id}", response_model=PaymentResponse)
 async def get_payment(
     payment_id: int,
@@ -320,6 +765,74 @@ async def get_payment_by_order(
     return PaymentResponse.from_orm(payment)
 
 
+@app.get("/payments/{payment_id}/events")
+async def payment_events(payment_id: int, user_id: int = Depends(get_current_user_id)):
+    """
+    Stream a payment's status as server-sent events until it settles
+
+    Sends the current state first, then one "status" event per change. The
+    stream holds no database session; each check opens a short-lived one in
+    a worker thread, off the event loop.
+    """
+
+    def read_payment() -> Optional[PaymentResponse]:
+        db = SessionLocal()
+        try:
+            payment = (
+                db.query(Payment)
+                .filter(Payment.id == payment_id, Payment.user_id == user_id)
+                .first()
+            )
+            return PaymentResponse.from_orm(payment) if payment else None
+        finally:
+            db.close()
+
+    payment = await asyncio.to_thread(read_payment)
+    if not payment:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Payment not found"
+        )
+
+    settled = {
+        PaymentStatus.COMPLETED.value,
+        PaymentStatus.FAILED.value,
+        PaymentStatus.REFUNDED.value,
+    }
+
+    async def events():
+        nonlocal payment
+        loop = asyncio.get_running_loop()
+        started = last_sent = loop.time()
+        last_status = None
+
+        while True:
+            if payment.status != last_status:
+                data = json.dumps(jsonable_encoder(payment))
+                yield f"event: status\ndata: {data}\n\n"
+                last_status = payment.status
+                last_sent = loop.time()
+            if payment.status in settled:
+                return
+            if loop.time() - started > PAYMENT_EVENTS_TIMEOUT:
+                yield "event: timeout\ndata: {}\n\n"
+                return
+            if loop.time() - last_sent > PAYMENT_EVENTS_KEEPALIVE:
+                yield ": keepalive\n\n"
+                last_sent = loop.time()
+
+            # Woken by this process's pipeline, polls for other replicas
+            await payment_pipeline.wait_for_change(
+                payment_id, PAYMENT_EVENTS_POLL_INTERVAL
+            )
+            payment = await asyncio.to_thread(read_payment) or payment
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
 @app.post("/payments/{payment_id}/refund", response_model=PaymentResponse)
 async def refund_payment(
     payment_id: int,
@@ -351,13 +864,10 @@ async def refund_payment(
 
     payment.status = PaymentStatus.REFUNDED.value
     payment.updated_at = datetime.utcnow()
+    queue_payment_notification(db, user_id, payment_id, "refunded", payment.amount)
     db.commit()
     db.refresh(payment)
-
-    # Send notification
-    asyncio.create_task(
-        send_payment_notification(user_id, payment_id, "refunded", payment.amount)
-    )
+    outbox_relay.notify()
 
     return PaymentResponse.from_orm(payment)
 
@@ -0,0 +1,121 @@
+"""
+Tests for the Idempotency-Key store shared by order-service and payment-service
+"""
+
+from fastapi import HTTPException, Response
+from sqlalchemy import create_engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+from common.idempotency import IdempotencyKeyMixin, IdempotencyStore
+import json
+import pytest
+
+Base = declarative_base()
+
+
+class IdempotencyKey(IdempotencyKeyMixin, Base):
+    __tablename__ = "idempotency_keys"
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'idempotency.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def store(session_factory):
+    return IdempotencyStore(session_factory, IdempotencyKey, ttl=60, lock_timeout=60)
+
+
+class Handler:
+    """Counts calls and returns (or raises) what it was given"""
+
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return self.result
+
+
+@pytest.mark.asyncio
+async def test_retry_replays_stored_response(store):
+    handler = Handler(result={"id": 1})
+    response = Response(status_code=201, headers={"Location": "/orders/1"})
+
+    first = await store.run("1:abc", "fp", response, 201, handler)
+    retry = await store.run("1:abc", "fp", Response(), 201, handler)
+
+    assert first == {"id": 1}
+    assert handler.calls == 1
+    assert retry.status_code == 201
+    assert json.loads(retry.body) == {"id": 1}
+    assert retry.headers["location"] == "/orders/1"
+    assert retry.headers["idempotent-replayed"] == "true"
+
+
+@pytest.mark.asyncio
+async def test_key_reused_for_different_request(store):
+    await store.run("1:abc", "fp", Response(), 201, Handler(result={"id": 1}))
+
+    with pytest.raises(HTTPException) as e:
+        await store.run("1:abc", "other", Response(), 201, Handler())
+    assert e.value.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_request_in_flight(store):
+    assert store.claim("1:abc", "fp") is None
+
+    with pytest.raises(HTTPException) as e:
+        await store.run("1:abc", "fp", Response(), 201, Handler())
+    assert e.value.status_code == 409
+    assert e.value.headers == {"Retry-After": "1"}
+
+
+@pytest.mark.asyncio
+async def test_client_error_is_stored(store):
+    failing = Handler(error=HTTPException(status_code=400, detail="Bad order"))
+    with pytest.raises(HTTPException):
+        await store.run("1:abc", "fp", Response(), 201, failing)
+
+    retry = await store.run("1:abc", "fp", Response(), 201, Handler())
+    assert retry.status_code == 400
+    assert json.loads(retry.body) == {"detail": "Bad order"}
+    assert failing.calls == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "error", [HTTPException(status_code=503, detail="Down"), RuntimeError("crash")]
+)
+async def test_failure_releases_key(store, error):
+    with pytest.raises(type(error)):
+        await store.run("1:abc", "fp", Response(), 201, Handler(error=error))
+
+    handler = Handler(result={"id": 2})
+    assert await store.run("1:abc", "fp", Response(), 201, handler) == {"id": 2}
+    assert handler.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_abandoned_lock_is_taken_over(session_factory):
+    store = IdempotencyStore(session_factory, IdempotencyKey, ttl=60, lock_timeout=0)
+    assert store.claim("1:abc", "fp") is None
+
+    handler = Handler(result={"id": 3})
+    assert await store.run("1:abc", "fp", Response(), 201, handler) == {"id": 3}
+    assert handler.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_key_too_long(store):
+    with pytest.raises(HTTPException) as e:
+        await store.run("1:" + "k" * 300, "fp", Response(), 201, Handler())
+    assert e.value.status_code == 400
@@ -0,0 +1,245 @@
+"""
+Tests for notification-service's delivery worker against an in-process SMTP sink
+"""
+
+from aiosmtpd.controller import Controller
+from datetime import datetime, timedelta
+from email import message_from_bytes
+from sqlalchemy import select
+import asyncio
+import importlib.util
+import pathlib
+import socket
+import time
+import pytest
+import pytest_asyncio
+
+pytestmark = pytest.mark.asyncio
+
+SERVICE = pathlib.Path(__file__).parent / "notification-service" / "app" / "main.py"
+
+
+class SMTPSink:
+    """Records every accepted message and the connection it arrived on"""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.messages = []  # (received_at, recipients, message)
+        self.connections = set()
+        self.rejected = set()  # Recipients answered with 550
+
+    def reset(self):
+        self.messages.clear()
+        self.connections.clear()
+        self.rejected.clear()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.rejected:
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.connections.add(session.peer)
+        self.messages.append(
+            (time.monotonic(), envelope.rcpt_tos, message_from_bytes(envelope.content))
+        )
+        return "250 Message accepted for delivery"
+
+
+@pytest.fixture(scope="module")
+def sink():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    handler = SMTPSink(port)
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    yield handler
+    controller.stop()
+
+
+@pytest.fixture(scope="module")
+def service(sink, tmp_path_factory):
+    """notification-service configured to send email to the sink"""
+    database = tmp_path_factory.mktemp("notification") / "notification.db"
+    with pytest.MonkeyPatch.context() as env:
+        env.setenv("DATABASE_URL", f"sqlite+aiosqlite:///{database}")
+        env.setenv("EMAIL_BACKEND", "smtp")
+        env.setenv("SMTP_SERVER", "127.0.0.1")
+        env.setenv("SMTP_PORT", str(sink.port))
+        env.setenv("SMTP_STARTTLS", "false")
+        env.setenv("SMTP_POOL_SIZE", "2")
+        spec = importlib.util.spec_from_file_location("notification_service", SERVICE)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+
+@pytest_asyncio.fixture
+async def db(service, sink):
+    async with service.engine.begin() as conn:
+        await conn.run_sync(service.Base.metadata.create_all)
+    sink.reset()
+    yield service.SessionLocal
+    service.smtp_pool.close()
+    async with service.engine.begin() as conn:
+        await conn.run_sync(service.Base.metadata.drop_all)
+    # Pooled connections belong to this test's event loop
+    await service.engine.dispose()
+
+
+def make_worker(service, batch_size=50, max_attempts=3, retry_backoff=30.0):
+    worker = service.DeliveryWorker(
+        batch_size,
+        poll_interval=0.05,
+        lease_seconds=60.0,
+        max_attempts=max_attempts,
+        retry_backoff=retry_backoff,
+    )
+    worker.smtp_slots = asyncio.Semaphore(service.SMTP_POOL_SIZE)
+    return worker
+
+
+async def add_notifications(service, db, channel, user_ids):
+    for user_id in user_ids:
+        service.user_directory.store(
+            user_id,
+            service.UserProfile(
+                id=user_id,
+                email=f"user{user_id}@example.com",
+                username=f"user{user_id}",
+                is_active=True,
+            ),
+            time.monotonic() + 3600,
+        )
+    async with db() as session:
+        session.add_all(
+            [
+                service.Notification(
+                    user_id=user_id,
+                    type="order_update",
+                    channel=channel,
+                    subject=f"Order for user {user_id}",
+                    message="Your order has shipped",
+                )
+                for user_id in user_ids
+            ]
+        )
+        await session.commit()
+
+
+async def notifications(service, db):
+    async with db() as session:
+        return {
+            n.user_id: n
+            for n in await session.scalars(
+                select(service.Notification).order_by(service.Notification.id)
+            )
+        }
+
+
+async def test_delivers_in_batches(service, sink, db):
+    await add_notifications(service, db, "email", range(1, 6))
+    worker = make_worker(service, batch_size=3)
+
+    assert await worker.deliver_batch() == 3
+    assert await worker.deliver_batch() == 2
+    assert await worker.deliver_batch() == 0
+
+    assert sorted(rcpt for _, (rcpt,), _ in sink.messages) == [
+        f"user{user_id}@example.com" for user_id in range(1, 6)
+    ]
+    _, _, message = sink.messages[0]
+    assert message["Subject"].startswith("Order for user")
+    assert message["From"] == service.FROM_EMAIL
+    stored = await notifications(service, db)
+    assert all(n.sent and n.sent_at for n in stored.values())
+
+
+async def test_reuses_smtp_sessions(service, sink, db):
+    await add_notifications(service, db, "email", range(1, 9))
+    worker = make_worker(service, batch_size=4)
+
+    while await worker.deliver_batch():
+        pass
+
+    assert len(sink.messages) == 8
+    # Never more sessions than the pool holds, however many emails went out
+    assert len(sink.connections) <= service.SMTP_POOL_SIZE
+    assert len(service.smtp_pool.idle) == len(sink.connections)
+
+
+async def test_rate_limits_each_channel(service, sink, db, monkeypatch):
+    monkeypatch.setitem(service.CHANNEL_RATE_LIMITS, "email", 5)
+    monkeypatch.setitem(service.CHANNEL_RATE_LIMITS, "sms", 1000)
+    await add_notifications(service, db, "email", range(1, 11))
+    await add_notifications(service, db, "sms", range(11, 21))
+    worker = make_worker(service)
+
+    started = time.monotonic()
+    assert await worker.deliver_batch() == 20
+    elapsed = time.monotonic() - started
+
+    # A second's worth goes out at once, the rest five a second; the tenth
+    # email waits 0.8s while sms is not held up by the email limit
+    received = sorted(at for at, _, _ in sink.messages)
+    assert len(received) == 10
+    assert received[-1] - started >= 0.8
+    assert elapsed < 2.0
+    stored = await notifications(service, db)
+    assert all(n.sent for n in stored.values())
+
+
+async def test_failed_sends_are_retried_then_given_up(service, sink, db):
+    sink.rejected.add("user2@example.com")
+    await add_notifications(service, db, "email", [1, 2])
+    worker = make_worker(service, max_attempts=2, retry_backoff=30.0)
+
+    before = datetime.utcnow()
+    assert await worker.deliver_batch() == 2
+    stored = await notifications(service, db)
+    assert stored[1].sent
+    failed = stored[2]
+    assert not failed.sent
+    assert failed.attempts == 1
+    assert "No such user" in failed.last_error
+    assert failed.next_attempt_at >= before + timedelta(seconds=30)
+
+    # Backing off, nothing to send until the retry time
+    assert await worker.deliver_batch() == 0
+
+    async with db() as session:
+        row = await session.get(service.Notification, failed.id)
+        row.next_attempt_at = datetime.utcnow()
+        await session.commit()
+    assert await worker.deliver_batch() == 1
+    stored = await notifications(service, db)
+    assert stored[2].attempts == 2
+    assert stored[2].next_attempt_at >= datetime.utcnow() + timedelta(seconds=59)
+
+    # Out of attempts, the notification is never claimed again
+    async with db() as session:
+        row = await session.get(service.Notification, failed.id)
+        row.next_attempt_at = datetime.utcnow()
+        await session.commit()
+    assert await worker.deliver_batch() == 0
+    assert [rcpt for _, rcpt, _ in sink.messages] == [["user1@example.com"]]
+
+
+async def test_missing_email_address_fails_without_sending(service, sink, db):
+    service.user_directory.store(99, None, time.monotonic() + 3600)
+    async with db() as session:
+        session.add(
+            service.Notification(
+                user_id=99, type="order_update", channel="email", message="Hi"
+            )
+        )
+        await session.commit()
+    worker = make_worker(service)
+
+    assert await worker.deliver_batch() == 1
+    stored = await notifications(service, db)
+    assert stored[99].last_error == "No email address for user"
+    assert stored[99].attempts == 1
+    assert sink.messages == []
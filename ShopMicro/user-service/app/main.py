@@ -1,12 +1,16 @@
 from fastapi import FastAPI, HTTPException, Depends, status
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import create_engine, update, Column, Integer, String, DateTime, Boolean
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, Session
-from pydantic import BaseModel, EmailStr
-from passlib.context import CryptContext
+from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime, timedelta
+import asyncio
+import bcrypt
 import jwt
-from typing import Optional
+from typing import Optional, List
 import os
 
 # Database configuration
@@ -22,12 +26,29 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing: bcrypt cost and the process pool that runs it
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(
+    os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1))
+)
+# Requests allowed to wait for a hashing worker before answering 503
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", "100"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    password_hasher.start()
+    try:
+        yield
+    finally:
+        password_hasher.stop()
+
 
 app = FastAPI(
     title="User Service",
     description="User management and authentication microservice",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 
@@ -76,6 +97,15 @@ class UserResponse(BaseModel):
         from_attributes = True
 
 
+class UserBatchRequest(BaseModel):
+    user_ids: List[int] = Field(..., min_length=1, max_length=1000)
+
+
+class UserBatchResponse(BaseModel):
+    users: List[UserResponse]
+    missing: List[int]
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -92,12 +122,114 @@ def get_db():
 
 
 # ===== UTILITY FUNCTIONS =====
+def password_bytes(password: str) -> bytes:
+    # bcrypt only uses the first 72 bytes, older versions truncated silently
+    return password.encode()[:72]
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    try:
+        return bcrypt.checkpw(password_bytes(plain_password), hashed_password.encode())
+    except ValueError:
+        return False  # Not a bcrypt hash
+
+
+def get_password_hash(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return bcrypt.hashpw(password_bytes(password), bcrypt.gensalt(rounds)).decode()
+
+
+def hash_rounds(hashed_password: str) -> Optional[int]:
+    """Cost factor of a bcrypt hash ("$2b$12$..." -> 12)"""
+    try:
+        return int(hashed_password.split("$")[2])
+    except (IndexError, ValueError):
+        return None
 
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+class PasswordHasher:
+    """
+    bcrypt hashing and verification in a bounded process pool
+
+    Each hash takes hundreds of milliseconds of CPU, so it runs in a worker
+    process instead of on the event loop. At most `workers` run at once and
+    up to queue_size more requests wait for a worker; past that requests
+    get a 503 rather than piling up behind a login storm.
+    """
+
+    def __init__(self, workers: int, queue_size: int, rounds: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.rounds = rounds
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+
+    def start(self):
+        self.pool = ProcessPoolExecutor(self.workers)
+        self.slots = asyncio.Semaphore(self.workers)
+
+    def stop(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    async def run(self, fn, *args):
+        if self.waiting >= self.queue_size:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many password checks in progress",
+                headers={"Retry-After": "1"},
+            )
+
+        loop = asyncio.get_running_loop()
+        queued_at = loop.time()
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.wait_seconds += loop.time() - queued_at
+
+        self.running += 1
+        try:
+            return await loop.run_in_executor(self.pool, fn, *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self.slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self.run(get_password_hash, password, self.rounds)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, password, hashed_password)
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        return hash_rounds(hashed_password) != self.rounds
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "waiting": self.waiting,
+            "queue_size": self.queue_size,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": (
+                round(self.wait_seconds / self.completed * 1000, 2)
+                if self.completed
+                else 0.0
+            ),
+            "bcrypt_rounds": self.rounds,
+        }
+
+
+password_hasher = PasswordHasher(
+    PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_SIZE, BCRYPT_ROUNDS
+)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -129,6 +261,12 @@ async def health_check():
     return {"status": "healthy", "service": "user-service"}
 
 
+@app.get("/metrics")
+async def user_service_metrics():
+    """Password hashing pool statistics"""
+    return {"password_hashing": password_hasher.stats()}
+
+
 @app.post("/users/register", response_model=Token, status_code=status.HTTP_201_CREATED)
 async def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
     """Register a new user"""
@@ -146,8 +284,11 @@ async def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
             detail="Email or username already registered",
         )
 
+    # Hand the connection back to the pool while the password is hashed
+    db.rollback()
+
     # Create new user
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await password_hasher.hash(user_data.password)
     db_user = User(
         email=user_data.email,
         username=user_data.username,
@@ -156,7 +297,15 @@ async def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
     )
 
     db.add(db_user)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # Registered concurrently while the password was being hashed
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email or username already registered",
+        )
     db.refresh(db_user)
 
     # Create access token
@@ -180,7 +329,15 @@ async def login_user(login_data: UserLogin, db: Session = Depends(get_db)):
     # Find user by email
     user = db.query(User).filter(User.email == login_data.email).first()
 
-    if not user or not verify_password(login_data.password, user.hashed_password):
+    # Keep the user loaded but hand the connection back to the pool while the
+    # password check waits for a hashing worker
+    if user:
+        db.expunge(user)
+    db.rollback()
+
+    if not user or not await password_hasher.verify(
+        login_data.password, user.hashed_password
+    ):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -191,6 +348,16 @@ async def login_user(login_data: UserLogin, db: Session = Depends(get_db)):
             status_code=status.HTTP_403_FORBIDDEN, detail="User account is inactive"
         )
 
+    # Upgrade hashes made with an older cost while the password is at hand
+    if password_hasher.needs_rehash(user.hashed_password):
+        hashed_password = await password_hasher.hash(login_data.password)
+        db.execute(
+            update(User)
+            .where(User.id == user.id, User.hashed_password == user.hashed_password)
+            .values(hashed_password=hashed_password)
+        )
+        db.commit()
+
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -236,6 +403,19 @@ async def get_user(user_id: int, db: Session = Depends(get_db)):
     return UserResponse.from_orm(user)
 
 
+@app.post("/users/batch", response_model=UserBatchResponse)
+async def get_users_batch(batch_data: UserBatchRequest, db: Session = Depends(get_db)):
+    """Get many users in one query - internal service call"""
+    user_ids = set(batch_data.user_ids)
+    users = [
+        UserResponse.from_orm(user)
+        for user in db.query(User).filter(User.id.in_(user_ids))
+    ]
+
+    found_ids = {user.id for user in users}
+    return UserBatchResponse(users=users, missing=sorted(user_ids - found_ids))
+
+
 @app.get("/users/email/{email}", response_model=UserResponse)
 async def get_user_by_email(email: str, db: Session = Depends(get_db)):
     """Get user by email - internal service call"""